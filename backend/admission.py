@@ -0,0 +1,152 @@
+"""
+Admission control: separate concurrency pools for LLM calls and DB-only
+routes, so slow AI calls cannot occupy every worker thread. The 'ai' pool
+is taken around the model call itself (`with admit('ai')`), so the DB
+writes of the same request are never shed by it.
+
+Each pool admits up to `concurrency` requests at once and lets at most
+`queue_size` more wait up to `queue_timeout` seconds for a slot. Anything
+beyond that is shed with 503 + Retry-After. With gthread workers, keep
+AI concurrency + AI queue + EVENTS_MAX_STREAMS (open SSE streams hold a
+thread each) below GUNICORN_THREADS so some threads are always left for
+cheap reads.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+# Smoothing factor of the moving average of service times
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """Raised when a pool sheds a request; rendered as 503 + Retry-After."""
+
+    def __init__(self, pool, reason, retry_after):
+        super().__init__(f"{pool} pool overloaded ({reason})")
+        self.pool = pool
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionPool:
+    def __init__(self, name, concurrency, queue_size, queue_timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.avg_service_seconds = None
+
+    def retry_after(self):
+        """Seconds until a slot is likely free, from the average service time."""
+        service = self.avg_service_seconds or 1.0
+        waves = (self.queued + 1) / max(self.concurrency, 1)
+        return max(1, min(60, math.ceil(service * waves)))
+
+    def acquire(self):
+        with self._cond:
+            if self.in_flight >= self.concurrency:
+                if self.queued >= self.queue_size:
+                    self.shed_queue_full += 1
+                    raise Overloaded(self.name, "queue full", self.retry_after())
+                self.queued += 1
+                self.peak_queued = max(self.peak_queued, self.queued)
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self.in_flight >= self.concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.shed_timeout += 1
+                            raise Overloaded(self.name, "queue timeout", self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self, service_seconds):
+        with self._cond:
+            self.in_flight -= 1
+            if self.avg_service_seconds is None:
+                self.avg_service_seconds = service_seconds
+            else:
+                self.avg_service_seconds += SERVICE_TIME_ALPHA * (service_seconds - self.avg_service_seconds)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "concurrency": self.concurrency,
+                "queue_size": self.queue_size,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "peak_queued": self.peak_queued,
+                "admitted": self.admitted,
+                "shed_queue_full": self.shed_queue_full,
+                "shed_timeout": self.shed_timeout,
+                "avg_service_seconds": (
+                    None if self.avg_service_seconds is None else round(self.avg_service_seconds, 3)),
+            }
+
+
+def init_admission(app):
+    """Creates the app's 'ai' and 'db' pools from its ADMISSION_* config."""
+    app.extensions["admission"] = {
+        name: AdmissionPool(
+            name,
+            concurrency=app.config[f"ADMISSION_{name.upper()}_CONCURRENCY"],
+            queue_size=app.config[f"ADMISSION_{name.upper()}_QUEUE"],
+            queue_timeout=app.config[f"ADMISSION_{name.upper()}_QUEUE_TIMEOUT_SECONDS"],
+        )
+        for name in ("ai", "db")
+    }
+
+
+@contextmanager
+def admit(pool_name):
+    """Holds a slot of the named pool for the duration of the block (raises Overloaded)."""
+    pool = current_app.extensions["admission"][pool_name]
+    pool.acquire()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        pool.release(time.monotonic() - start)
+
+
+def admission(pool_name):
+    """Runs the whole view inside a slot of the named pool (CORS preflights skip it)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method == 'OPTIONS':
+                return view(*args, **kwargs)
+            with admit(pool_name):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def overloaded_response(error):
+    response = jsonify({
+        'error': 'サーバーが混み合っています。しばらくしてから再度お試しください。',
+        'retry_after': error.retry_after,
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def admission_stats():
+    return {name: pool.stats() for name, pool in current_app.extensions["admission"].items()}
@@ -0,0 +1,33 @@
+import os
+import threading
+
+# google.generativeai is heavy to import (~0.6s), so it is loaded on first use
+# instead of at app import time.
+_genai = None
+_lock = threading.Lock()
+
+DEFAULT_MODEL = 'gemini-2.5-flash'
+
+
+def get_genai():
+    """Imports and configures the Gemini SDK on first use."""
+    global _genai
+    if _genai is None:
+        with _lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+                _genai = genai
+    return _genai
+
+
+def reset_client():
+    """Forgets the configured SDK so it is re-configured (e.g. after a fork)."""
+    global _genai
+    with _lock:
+        _genai = None
+
+
+def generative_model(model_name=DEFAULT_MODEL, **kwargs):
+    """Returns a GenerativeModel, loading the SDK if needed."""
+    return get_genai().GenerativeModel(model_name, **kwargs)
@@ -0,0 +1,327 @@
+"""
+Cohort analytics: per-user daily summaries, score histograms, cohort
+averages and streak retention, written by `flask run-analytics`.
+
+Every change to a log that the summaries depend on is recorded in
+analytics_log_changes in the same transaction: a +1 row for a new log, a
+-1 row with the old values and a +1 row with the new ones when its score,
+duration, type or date changes (e.g. the hybrid score refinement), and a
+-1 row when it is deleted. The job applies whatever rows are there and
+deletes them, so changes committed in any order are counted exactly once
+and writers never wait for the job.
+"""
+import datetime
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from models import (ActivityLog, AnalyticsLogChange, AnalyticsWatermark,
+                    CohortDailySummary, ScoreHistogram, StreakRetention,
+                    User, UserDailySummary)
+from sqlalchemy import (case, delete, event, func, inspect, insert, literal,
+                        select)
+from sqlalchemy.orm import Session
+
+JOB_NAME = 'cohort'
+# Streaks of STREAK_CAP days or more share the last bucket
+STREAK_CAP = 30
+# A user is "retained" if they log anything within this many days after the reference date
+RETENTION_WINDOW_DAYS = 7
+
+# Indexes into the per-(user, day) aggregate lists
+SESSIONS, MINUTES, SCORE_SUM, SCORE_COUNT, LIFE_LOGS = range(5)
+# ActivityLog attributes the summaries are computed from
+CHANGE_FIELDS = ('user_id', 'created_at', 'log_type', 'score', 'duration_minutes')
+# Change rows deleted per statement once applied
+DELETE_CHUNK_SIZE = 500
+
+
+def score_bucket(score):
+    """Maps a 0-100 score to a histogram bucket (0-9 by tens, 10 for a perfect score)."""
+    return max(0, min(int(score) // 10, 10))
+
+
+def aggregate_chunk(rows):
+    """
+    Aggregates a chunk of (user_id, created_at, log_type, score, duration_minutes, sign)
+    rows; a row with sign -1 is subtracted. Runs in a worker process, so it
+    must stay free of DB/app access.
+    """
+    user_days = {}
+    histogram = {}
+    for user_id, created_at, log_type, score, minutes, sign in rows:
+        day = created_at.date()
+        totals = user_days.setdefault((user_id, day), [0, 0, 0.0, 0, 0])
+
+        if log_type == 'life':
+            totals[LIFE_LOGS] += sign
+            continue
+
+        totals[SESSIONS] += sign
+        if minutes is not None:
+            totals[MINUTES] += sign * minutes
+        if score is not None:
+            totals[SCORE_SUM] += sign * score
+            totals[SCORE_COUNT] += sign
+            key = (day, score_bucket(score))
+            histogram[key] = histogram.get(key, 0) + sign
+    return user_days, histogram
+
+
+def merge_aggregates(total, partial):
+    user_days, histogram = partial
+    for key, values in user_days.items():
+        current = total[0].setdefault(key, [0, 0, 0.0, 0, 0])
+        for i, value in enumerate(values):
+            current[i] += value
+    for key, count in histogram.items():
+        total[1][key] = total[1].get(key, 0) + count
+
+
+# --- Change recording ---
+def _change_row(log, sign, values=None):
+    values = values or {field: getattr(log, field) for field in CHANGE_FIELDS}
+    return {'log_id': log.id, 'sign': sign, **values}
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_log_changes(session, flush_context):
+    rows = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, ActivityLog):
+            continue
+        if obj in session.new:
+            rows.append(_change_row(obj, 1))
+            continue
+        state = inspect(obj)
+        histories = {field: state.attrs[field].history for field in CHANGE_FIELDS}
+        # The values as loaded, i.e. as last added to the summaries
+        old = {field: history.deleted[0] if history.deleted else getattr(obj, field)
+               for field, history in histories.items()}
+        if obj in session.deleted:
+            rows.append(_change_row(obj, -1, old))
+        elif any(history.has_changes() for history in histories.values()):
+            rows.append(_change_row(obj, -1, old))
+            rows.append(_change_row(obj, 1))
+    if rows:
+        session.connection().execute(insert(AnalyticsLogChange), rows)
+
+
+def record_log_removals(session, *criteria):
+    """
+    Queues the removal of the logs matching `criteria` from the summaries.
+    For DELETE statements, which bypass the flush hook; call it first.
+    """
+    session.execute(insert(AnalyticsLogChange).from_select(
+        ['log_id', *CHANGE_FIELDS, 'sign'],
+        select(ActivityLog.id, *[getattr(ActivityLog, field) for field in CHANGE_FIELDS], literal(-1))
+        .where(*criteria)
+    ))
+
+
+def streak_ending_at(active_days, day):
+    """Counts consecutive active days ending at `day` (or the day before, like /api/me/stats)."""
+    if day not in active_days:
+        day -= datetime.timedelta(days=1)
+    streak = 0
+    while day in active_days:
+        streak += 1
+        day -= datetime.timedelta(days=1)
+    return streak
+
+
+def compute_streak_retention(active_days_by_user, reference_date, today):
+    """
+    Groups users active on or before `reference_date` by their streak at that
+    date, and counts how many of them logged again after it.
+    Returns {streak_bucket: [users, retained_users]}.
+    """
+    retention = {}
+    for active_days in active_days_by_user.values():
+        if not any(day <= reference_date for day in active_days):
+            continue
+        streak = min(streak_ending_at(active_days, reference_date), STREAK_CAP)
+        retained = any(reference_date < day <= today for day in active_days)
+        counts = retention.setdefault(streak, [0, 0])
+        counts[0] += 1
+        counts[1] += int(retained)
+    return retention
+
+
+def _read_chunks(session, model, chunk_size, applied_ids=None):
+    """
+    Streams (user_id, ..., sign) rows of every log or every pending change
+    with a server-side cursor, chunk_size rows at a time. The ids of read
+    changes are appended to `applied_ids`.
+    """
+    sign = model.sign if model is AnalyticsLogChange else literal(1)
+    result = session.execute(
+        select(model.id, *[getattr(model, field) for field in CHANGE_FIELDS], sign)
+        .order_by(model.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for partition in result.partitions():
+        if applied_ids is not None:
+            applied_ids.extend(row[0] for row in partition)
+        yield [tuple(row[1:]) for row in partition]
+
+
+def _aggregate(session, model, chunk_size, workers, applied_ids=None):
+    total = [{}, {}]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in _read_chunks(session, model, chunk_size, applied_ids):
+            pending.add(executor.submit(aggregate_chunk, chunk))
+            # Bound the number of chunks held in memory
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    merge_aggregates(total, future.result())
+        for future in pending:
+            merge_aggregates(total, future.result())
+    return total
+
+
+def _write_user_days(session, user_days):
+    days = {day for _, day in user_days}
+    existing = {
+        (row.user_id, row.date): row
+        for row in UserDailySummary.query.filter(UserDailySummary.date.in_(days))
+    } if days else {}
+    # Removals of a deleted account's logs; its summaries went with it
+    user_ids = {user_id for user_id, _ in user_days}
+    live_users = set(session.scalars(select(User.id).where(User.id.in_(user_ids)))) if user_ids else set()
+    for (user_id, day), values in user_days.items():
+        if user_id not in live_users or not any(values):
+            continue
+        row = existing.get((user_id, day))
+        if row is None:
+            row = UserDailySummary(user_id=user_id, date=day, focus_sessions=0, focus_minutes=0,
+                                   score_sum=0, score_count=0, life_logs=0)
+        row.focus_sessions += values[SESSIONS]
+        row.focus_minutes += values[MINUTES]
+        row.score_sum += values[SCORE_SUM]
+        row.score_count += values[SCORE_COUNT]
+        row.life_logs += values[LIFE_LOGS]
+        if row.focus_sessions <= 0 and row.life_logs <= 0:
+            # Every log of the day was removed
+            if (user_id, day) in existing:
+                session.delete(row)
+        elif (user_id, day) not in existing:
+            session.add(row)
+
+
+def _write_histogram(session, histogram):
+    days = {day for day, _ in histogram}
+    existing = {
+        (row.date, row.bucket): row
+        for row in ScoreHistogram.query.filter(ScoreHistogram.date.in_(days))
+    } if days else {}
+    for (day, bucket), count in histogram.items():
+        if not count:
+            continue
+        row = existing.get((day, bucket))
+        if row is None:
+            row = ScoreHistogram(date=day, bucket=bucket, count=0)
+        row.count += count
+        if row.count <= 0:
+            if (day, bucket) in existing:
+                session.delete(row)
+        elif (day, bucket) not in existing:
+            session.add(row)
+
+
+def refresh_cohort_days(session, days):
+    """Recomputes the cross-user daily averages for the given days."""
+    if not days:
+        return
+    rows = session.query(
+        UserDailySummary.date,
+        func.count().label('active_users'),
+        func.sum(case((UserDailySummary.focus_sessions > 0, 1), else_=0)).label('focus_users'),
+        func.sum(UserDailySummary.focus_minutes).label('focus_minutes'),
+        func.sum(UserDailySummary.score_sum).label('score_sum'),
+        func.sum(UserDailySummary.score_count).label('score_count'),
+    ).filter(UserDailySummary.date.in_(days)).group_by(UserDailySummary.date).all()
+
+    for row in rows:
+        summary = session.get(CohortDailySummary, row.date) or CohortDailySummary(date=row.date)
+        summary.active_users = row.active_users
+        summary.focus_users = row.focus_users
+        summary.avg_focus_minutes = row.focus_minutes / row.focus_users if row.focus_users else None
+        summary.avg_score = row.score_sum / row.score_count if row.score_count else None
+        session.add(summary)
+
+    # Days whose logs were all deleted
+    empty_days = set(days) - {row.date for row in rows}
+    if empty_days:
+        CohortDailySummary.query.filter(CohortDailySummary.date.in_(empty_days)).delete()
+
+
+def _refresh_streak_retention(session, today):
+    reference_date = today - datetime.timedelta(days=RETENTION_WINDOW_DAYS)
+    window_start = reference_date - datetime.timedelta(days=STREAK_CAP + 1)
+
+    active_days_by_user = {}
+    for user_id, day in session.query(UserDailySummary.user_id, UserDailySummary.date).filter(
+            UserDailySummary.date >= window_start):
+        active_days_by_user.setdefault(user_id, set()).add(day)
+    # Users whose activity predates the window still count, with a streak of 0
+    for (user_id,) in session.query(UserDailySummary.user_id).filter(
+            UserDailySummary.date < window_start).distinct():
+        active_days_by_user.setdefault(user_id, set()).add(window_start - datetime.timedelta(days=1))
+
+    retention = compute_streak_retention(active_days_by_user, reference_date, today)
+    now = datetime.datetime.utcnow()
+    StreakRetention.query.delete()
+    for streak, (users, retained) in sorted(retention.items()):
+        session.add(StreakRetention(streak_length=streak, users=users,
+                                    retained_users=retained, computed_at=now))
+
+
+def run_cohort_analytics(session, chunk_size=5000, workers=2, full=False):
+    """
+    Applies the pending analytics_log_changes to the summary tables and
+    deletes them; with `full`, rebuilds the summaries from every log
+    instead. Everything is committed in one transaction, so a failed run can
+    simply be retried. Returns (number of applied changes or logs, number
+    of touched days).
+    """
+    # Only other runs wait for this lock; writers just insert change rows
+    job = session.get(AnalyticsWatermark, JOB_NAME, with_for_update=True)
+    if job is None:
+        job = AnalyticsWatermark(job_name=JOB_NAME)
+        session.add(job)
+
+    applied_ids = []
+    if full:
+        UserDailySummary.query.delete()
+        ScoreHistogram.query.delete()
+        CohortDailySummary.query.delete()
+        # Changes committed while the logs are read would be counted twice,
+        # so rebuild while nothing is being written
+        session.execute(delete(AnalyticsLogChange))
+        user_days, histogram = _aggregate(session, ActivityLog, chunk_size, workers)
+    else:
+        user_days, histogram = _aggregate(session, AnalyticsLogChange, chunk_size, workers, applied_ids)
+        # By id, not by range: rows with lower ids may still be uncommitted
+        for i in range(0, len(applied_ids), DELETE_CHUNK_SIZE):
+            session.execute(delete(AnalyticsLogChange).where(
+                AnalyticsLogChange.id.in_(applied_ids[i:i + DELETE_CHUNK_SIZE])))
+
+    _write_user_days(session, user_days)
+    _write_histogram(session, histogram)
+    session.flush()
+
+    touched_days = {day for _, day in user_days}
+    refresh_cohort_days(session, touched_days)
+    _refresh_streak_retention(session, datetime.datetime.utcnow().date())
+
+    job.updated_at = datetime.datetime.utcnow()
+    session.commit()
+
+    if full:
+        processed = sum(values[SESSIONS] + values[LIFE_LOGS] for values in user_days.values())
+    else:
+        processed = len(applied_ids)
+    logging.info(f"Cohort analytics applied {processed} {'logs' if full else 'changes'} ({len(touched_days)} days)")
+    return processed, len(touched_days)
@@ -0,0 +1,117 @@
+"""
+Measures response encoding cost and compression savings on realistic
+/api/history payloads (mostly Japanese task reports and AI feedback).
+
+    python benchmarks/bench_json_encoding.py --logs 200 1000 5000
+
+For each payload size it reports:
+  - encode time of the previous path (isoformat() loop + stdlib json with
+    ensure_ascii=False) versus FastJSONProvider (orjson when installed)
+  - body size and compression time for gzip and brotli at a few levels
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from flask import Flask  # noqa: E402
+from responses import FastJSONProvider, brotli, compress, orjson  # noqa: E402
+
+TASKS = [
+    "企画書のドラフト作成と構成の見直し",
+    "API設計レビューのコメント対応",
+    "英語の技術記事を読んで要点をまとめた",
+    "週次レポートの数値集計とグラフ作成",
+    "ユーザーインタビューの議事録整理",
+    "バグ修正（ログイン後にリダイレクトされない問題）",
+]
+FEEDBACK = [
+    "素晴らしい集中でした！作業内容が具体的で、成果がはっきりしています。次は休憩のタイミングも意識してみましょう。",
+    "良いペースです。タスクを小さく分けたことで集中が続いていますね。明日は午前中に難しい作業を入れてみましょう。",
+    "お疲れ様でした。睡眠時間が短めなので、今日は早めに切り上げてコンディションを整えるのがおすすめです。",
+]
+ADVICE = "睡眠時間が6時間を下回った日は集中スコアが下がる傾向があります。就寝前のスマホ時間を30分減らし、7時間の睡眠を確保してみましょう。"
+
+
+def make_history(num_logs, seed=0):
+    """Builds /api/history rows the way the route does (datetimes left as-is)."""
+    rng = random.Random(seed)
+    now = datetime.datetime(2025, 12, 1, 9, 0, 0)
+    rows = []
+    for i in range(num_logs):
+        created_at = now - datetime.timedelta(minutes=37 * i, microseconds=rng.randrange(10 ** 6))
+        if rng.random() < 0.75:
+            data = {
+                "task_content": rng.choice(TASKS),
+                "duration_minutes": rng.choice([15, 25, 30, 45, 60, 90]),
+                "focus_level": rng.randint(1, 5),
+                "score": rng.randint(30, 100),
+                "ai_feedback": rng.choice(FEEDBACK),
+                "score_source": "llm",
+            }
+            log_type = "focus"
+        else:
+            data = {
+                "sleep_hours": round(rng.uniform(4, 9), 1),
+                "screen_time": rng.randrange(30, 400),
+                "mood": rng.randint(1, 5),
+                "ai_advice": ADVICE,
+            }
+            log_type = "life"
+        rows.append({"id": num_logs - i, "user_id": 1, "created_at": created_at,
+                     "log_type": log_type, "data": data})
+    return rows
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def encode_stdlib(rows):
+    # What the route used to do: convert datetimes by hand, then json.dumps
+    converted = [{**row, "created_at": row["created_at"].isoformat()} for row in rows]
+    return json.dumps(converted, ensure_ascii=False).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logs", type=int, nargs="+", default=[200, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    provider = FastJSONProvider(app)
+    print(f"orjson: {'yes' if orjson else 'no (stdlib fallback)'}, brotli: {'yes' if brotli else 'no'}")
+
+    for num_logs in args.logs:
+        rows = make_history(num_logs)
+        stdlib_ms, body = timed(lambda: encode_stdlib(rows), args.repeat)
+        fast_ms, fast_body = timed(lambda: provider.response(rows).get_data(), args.repeat)
+        print(f"\n{num_logs} logs, {len(body) / 1024:.1f} KiB JSON")
+        print(f"  encode  stdlib+isoformat {stdlib_ms:7.2f} ms | FastJSONProvider {fast_ms:7.2f} ms "
+              f"({stdlib_ms / fast_ms:.1f}x)")
+
+        codecs = [("gzip", 1), ("gzip", 5), ("gzip", 9)]
+        if brotli:
+            codecs += [("br", 1), ("br", 4), ("br", 11)]
+        for encoding, level in codecs:
+            ms, compressed = timed(lambda: compress(fast_body, encoding, level), max(1, args.repeat // 4))
+            saved = 100 * (1 - len(compressed) / len(fast_body))
+            print(f"  {encoding:>4} level {level:2d}  {len(compressed) / 1024:8.1f} KiB  "
+                  f"({saved:4.1f}% saved)  {ms:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
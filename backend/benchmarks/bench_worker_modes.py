@@ -0,0 +1,128 @@
+"""
+Compares gunicorn worker classes under our AI-heavy request mix.
+
+    python benchmarks/bench_worker_modes.py --modes sync gthread gevent
+
+For each mode, starts gunicorn with gunicorn.conf.py serving
+benchmarks/mixed_load_app.py, fires a mix of slow AI requests and cheap
+reads from concurrent clients, and reports throughput and latency per
+route class. The same number of worker processes is used for every mode.
+"""
+import argparse
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + "/read", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not become ready")
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_load(url, duration, concurrency, ai_ratio, seed):
+    latencies = {"ai": [], "read": []}
+    errors = {"ai": 0, "read": 0}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(index):
+        rng = random.Random(seed + index)
+        while time.time() < deadline:
+            kind = "ai" if rng.random() < ai_ratio else "read"
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(f"{url}/{kind}", timeout=60).read()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies[kind].append(elapsed * 1000)
+            except OSError:
+                with lock:
+                    errors[kind] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    return latencies, errors
+
+
+def bench_mode(mode, args):
+    port = free_port()
+    env = dict(os.environ,
+               GUNICORN_WORKER_CLASS=mode,
+               GUNICORN_WORKERS=str(args.workers),
+               GUNICORN_BIND=f"127.0.0.1:{port}",
+               GUNICORN_ACCESSLOG="",
+               BENCH_AI_LATENCY=str(args.ai_latency))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "--chdir", "benchmarks", "mixed_load_app:app"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(url)
+        return run_load(url, args.duration, args.concurrency, args.ai_ratio, args.seed)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare gunicorn worker classes.")
+    parser.add_argument("--modes", nargs="+", default=["sync", "gthread", "gevent"])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--ai-ratio", type=float, default=0.3)
+    parser.add_argument("--ai-latency", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers, {args.concurrency} clients, {args.duration:.0f}s, "
+          f"{args.ai_ratio:.0%} AI requests at {args.ai_latency * 1000:.0f}ms")
+    print(f"{'mode':<8} {'req/s':>8} {'read p50':>9} {'read p95':>9} {'ai p50':>8} {'ai p95':>8} {'errors':>7}")
+    for mode in args.modes:
+        if mode == "gevent":
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print(f"{mode:<8} skipped (gevent is not installed)")
+                continue
+        latencies, errors = bench_mode(mode, args)
+        total = len(latencies["ai"]) + len(latencies["read"])
+        print(f"{mode:<8} {total / args.duration:8.1f} "
+              f"{statistics.median(latencies['read'] or [float('nan')]):8.0f}ms "
+              f"{percentile(latencies['read'], 0.95):8.0f}ms "
+              f"{statistics.median(latencies['ai'] or [float('nan')]):7.0f}ms "
+              f"{percentile(latencies['ai'], 0.95):7.0f}ms "
+              f"{errors['ai'] + errors['read']:7d}")
+
+
+if __name__ == "__main__":
+    main()
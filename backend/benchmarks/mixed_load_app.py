@@ -0,0 +1,29 @@
+"""
+Minimal WSGI app that mimics the latency profile of our routes, so that
+gunicorn worker classes can be compared without a database or API key.
+
+  /ai    - waits on a slow upstream call (Gemini), like /api/chat/*
+  /read  - a short DB query plus a little CPU, like /api/me or /api/history
+"""
+import os
+import time
+
+AI_LATENCY = float(os.getenv("BENCH_AI_LATENCY", "0.8"))
+READ_LATENCY = float(os.getenv("BENCH_READ_LATENCY", "0.005"))
+READ_CPU_ITERATIONS = int(os.getenv("BENCH_READ_CPU_ITERATIONS", "20000"))
+
+
+def app(environ, start_response):
+    path = environ.get("PATH_INFO", "")
+    if path == "/ai":
+        time.sleep(AI_LATENCY)
+    elif path == "/read":
+        time.sleep(READ_LATENCY)
+        total = 0
+        for i in range(READ_CPU_ITERATIONS):
+            total += i * i
+    else:
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"not found"]
+    start_response("200 OK", [("Content-Type", "application/json")])
+    return [b'{"ok": true}']
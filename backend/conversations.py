@@ -0,0 +1,98 @@
+import datetime
+import uuid
+
+from flask import current_app
+from models import ChatConversation, db
+
+# Each turn folded into the rolling summary is shortened to this many characters
+SUMMARY_TURN_CHARS = 80
+# Senders accepted in a client-supplied seed: only the greeting the client shows
+SEED_SENDERS = ('ai',)
+
+
+def _expires_before():
+    ttl = current_app.config["CONVERSATION_TTL_SECONDS"]
+    return datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+
+
+def evict_conversations(user_id):
+    """Deletes the user's expired conversations and the oldest ones above the cap."""
+    ChatConversation.query.filter(
+        ChatConversation.user_id == user_id,
+        ChatConversation.updated_at < _expires_before()
+    ).delete(synchronize_session=False)
+
+    max_per_user = current_app.config["CONVERSATION_MAX_PER_USER"]
+    stale_ids = [row.id for row in db.session.query(ChatConversation.id).filter(
+        ChatConversation.user_id == user_id
+    ).order_by(ChatConversation.updated_at.desc()).offset(max_per_user - 1)]
+    if stale_ids:
+        ChatConversation.query.filter(ChatConversation.id.in_(stale_ids)).delete(
+            synchronize_session=False)
+
+
+def start_conversation(user_id, kind, history=None, system_note=None):
+    """
+    Creates a conversation (added to the session, not committed).
+    `history` seeds it with turns the client already shows, e.g. the greeting.
+    The seed is untrusted: user and system turns in it are dropped, so it
+    cannot skip the new-conversation cooldown or inject instructions.
+    """
+    evict_conversations(user_id)
+    conversation = ChatConversation(
+        id=str(uuid.uuid4()), user_id=user_id, kind=kind, turns=[], summary=None)
+    seed = [(msg.get('sender'), msg.get('text')) for msg in (history or [])
+            if isinstance(msg, dict) and msg.get('sender') in SEED_SENDERS and isinstance(msg.get('text'), str)]
+    if system_note:
+        seed.insert(0, ('system', system_note))
+    append_turns(conversation, *seed)
+    db.session.add(conversation)
+    return conversation
+
+
+def get_conversation(conversation_id, user_id, kind):
+    """Returns the user's live conversation, or None if it is unknown or expired."""
+    conversation = db.session.get(ChatConversation, conversation_id)
+    if (not conversation or conversation.user_id != user_id or conversation.kind != kind
+            or conversation.updated_at < _expires_before()):
+        return None
+    return conversation
+
+
+def has_user_turn(conversation):
+    return bool(conversation.summary) or any(
+        turn['sender'] == 'user' for turn in conversation.turns)
+
+
+def append_turns(conversation, *turns):
+    """
+    Appends (sender, text) turns. Turns beyond CONVERSATION_MAX_TURNS are
+    folded into the rolling summary, which is capped in size.
+    """
+    all_turns = list(conversation.turns or []) + [
+        {"sender": sender, "text": text} for sender, text in turns]
+
+    max_turns = current_app.config["CONVERSATION_MAX_TURNS"]
+    overflow, kept = all_turns[:-max_turns], all_turns[-max_turns:]
+    if overflow:
+        folded = [f"{turn['sender']}: {turn['text'][:SUMMARY_TURN_CHARS]}" for turn in overflow]
+        summary = "\n".join(filter(None, [conversation.summary] + folded))
+        # Keep the newest part of the summary when it grows too large
+        max_chars = current_app.config["CONVERSATION_SUMMARY_MAX_CHARS"]
+        if len(summary) > max_chars:
+            # Drop the partially cut first line
+            summary = summary[-max_chars:].split("\n", 1)[-1]
+        conversation.summary = summary
+
+    # Reassign so SQLAlchemy detects the JSON change
+    conversation.turns = kept
+    conversation.updated_at = datetime.datetime.utcnow()
+
+
+def format_conversation(conversation):
+    """Formats the stored context (summary + recent turns) for a prompt."""
+    lines = []
+    if conversation.summary:
+        lines.append(f"（これまでの会話の要約）\n{conversation.summary}\n（以下、直近の会話）")
+    lines.extend(f"{turn['sender']}: {turn['text']}" for turn in conversation.turns)
+    return "\n".join(lines)
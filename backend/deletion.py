@@ -0,0 +1,153 @@
+"""
+Set-based deletion of activity logs and whole accounts.
+
+Logs are removed with DELETE statements instead of loading and deleting ORM
+objects one by one. Their search n-grams and embeddings go with them through
+ON DELETE CASCADE, and an account purge is a single DELETE of the user row
+that cascades to everything the user owns.
+
+Derived data is fixed up once per batch:
+  - rollups: a removal is queued in analytics_log_changes for every log,
+    and the next analytics run subtracts them (see analytics.py). Nothing
+    waits for a running analytics job.
+  - weekly feedback: the stored feedback may quote deleted logs, so it is
+    dropped and regenerated on the next request.
+  - open tabs: one 'deleted' event per log, or a single 'resync' for large
+    batches.
+"""
+import datetime
+
+from analytics import record_log_removals
+from events import SUBSCRIPTION_BUFFER, queue_event
+from models import (ActivityLog, ActivityLogEmbedding, ActivityLogNgram,
+                    AiCallLog, AiUsageDaily, AiUsageLog, ChatConversation,
+                    User, UserDailySummary, WeeklyFeedback)
+from sqlalchemy import delete, func, select
+from usage import buffer as usage_buffer
+
+# Upper bound of ids accepted by one bulk delete request
+MAX_BULK_DELETE_IDS = 1000
+# Ids per DELETE ... WHERE id IN (...) statement
+DELETE_CHUNK_SIZE = 500
+# Tables with a users.id foreign key (ON DELETE CASCADE), besides activity_log
+USER_OWNED_MODELS = (AiUsageLog, AiCallLog, AiUsageDaily, UserDailySummary, ChatConversation, WeeklyFeedback)
+
+
+def parse_bulk_delete_filters(data):
+    """
+    Validates a bulk delete request body: {"ids": [...]} and/or
+    {"start": ISO datetime, "end": ISO datetime, "log_type": "focus"|"life"}.
+    Returns keyword arguments for delete_logs; raises ValueError.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("request body must be an object")
+    filters = {}
+
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError("'ids' must be a list of integers")
+        if len(ids) > MAX_BULK_DELETE_IDS:
+            raise ValueError(f"at most {MAX_BULK_DELETE_IDS} ids per request")
+        filters['ids'] = ids
+
+    for key in ('start', 'end'):
+        value = data.get(key)
+        if value is None:
+            continue
+        try:
+            moment = datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{key}' must be an ISO 8601 datetime")
+        if moment.tzinfo is not None:
+            # created_at is naive UTC
+            moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        filters[key] = moment
+
+    log_type = data.get('log_type')
+    if log_type is not None:
+        if log_type not in ('focus', 'life'):
+            raise ValueError("'log_type' must be 'focus' or 'life'")
+        filters['log_type'] = log_type
+
+    if not filters:
+        raise ValueError("specify 'ids', 'start'/'end' or 'log_type'")
+    return filters
+
+
+def _chunks(values, size=DELETE_CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _delete_log_rows(session, log_ids):
+    connection = session.connection()
+    if connection.dialect.name == 'sqlite':
+        # SQLite does not enforce foreign keys (and so ON DELETE CASCADE) by default
+        for chunk in _chunks(log_ids):
+            connection.execute(delete(ActivityLogNgram).where(ActivityLogNgram.log_id.in_(chunk)))
+            connection.execute(delete(ActivityLogEmbedding).where(ActivityLogEmbedding.log_id.in_(chunk)))
+    for chunk in _chunks(log_ids):
+        connection.execute(delete(ActivityLog).where(ActivityLog.id.in_(chunk)))
+
+
+def delete_logs(session, user_id, ids=None, start=None, end=None, log_type=None):
+    """
+    Deletes the user's logs matching every given filter (start inclusive, end
+    exclusive) and fixes up derived data once for the whole batch. The caller
+    commits. Returns the number of deleted logs.
+    """
+    query = select(ActivityLog.id).where(ActivityLog.user_id == user_id)
+    if ids is not None:
+        query = query.where(ActivityLog.id.in_(ids))
+    if start is not None:
+        query = query.where(ActivityLog.created_at >= start)
+    if end is not None:
+        query = query.where(ActivityLog.created_at < end)
+    if log_type is not None:
+        query = query.where(ActivityLog.log_type == log_type)
+
+    # Locked, so a concurrent score refinement cannot change what is removed
+    log_ids = list(session.scalars(query.with_for_update()))
+    if not log_ids:
+        return 0
+
+    for chunk in _chunks(log_ids):
+        record_log_removals(session, ActivityLog.id.in_(chunk))
+    _delete_log_rows(session, log_ids)
+    session.execute(delete(WeeklyFeedback).where(WeeklyFeedback.user_id == user_id))
+
+    if len(log_ids) > SUBSCRIPTION_BUFFER:
+        queue_event(session, user_id, {'type': 'resync'})
+    else:
+        for log_id in log_ids:
+            queue_event(session, user_id, {'type': 'deleted', 'log_id': log_id})
+
+    # Drop this worker's cached vectors; other workers skip deleted logs on lookup
+    from embeddings import evict_user_indexes
+    evict_user_indexes(user_id)
+    return len(log_ids)
+
+
+def purge_user(session, user_id):
+    """
+    Deletes an account and everything it owns. The caller commits.
+    Returns the number of deleted activity logs.
+    """
+    # Histograms and cohort averages are shared with other users, so
+    # queue the removal of this user's logs before the cascade deletes them
+    record_log_removals(session, ActivityLog.user_id == user_id)
+
+    deleted = session.scalar(select(func.count()).select_from(ActivityLog).where(ActivityLog.user_id == user_id))
+    if session.connection().dialect.name == 'sqlite':
+        _delete_log_rows(session, list(session.scalars(
+            select(ActivityLog.id).where(ActivityLog.user_id == user_id))))
+        for model in USER_OWNED_MODELS:
+            session.execute(delete(model).where(model.user_id == user_id))
+    session.execute(delete(User).where(User.id == user_id))
+
+    from embeddings import evict_user_indexes
+    evict_user_indexes(user_id)
+    # Calls buffered by other workers are dropped by their flush, see usage.py
+    usage_buffer.discard_user(user_id)
+    return deleted
@@ -0,0 +1,199 @@
+"""
+Task embeddings and a per-user nearest-neighbour index over past focus logs.
+
+Each focus log's task_content is embedded once, on save, and stored as
+float32 bytes in activity_log_embeddings. Each worker keeps an LRU cache of
+per-user matrices of L2-normalized vectors, so a lookup is one
+matrix-vector product. Every lookup first compares a cheap version of the
+user's stored vectors (count, max and sum of their log ids) with the cached
+one; only when it differs are the ids diffed, so vectors saved by other
+workers or backfilled by `flask embed-logs` are loaded and deleted logs
+dropped.
+
+Backends (EMBEDDING_BACKEND):
+  - local: deterministic feature hashing of character bigrams; no network,
+    so it also serves tests. Captures shared wording, not meaning.
+  - gemini: the Gemini embedding model.
+"""
+import collections
+import hashlib
+import threading
+import unicodedata
+
+import numpy as np
+from ai_client import get_genai
+from flask import current_app
+from models import ActivityLog, ActivityLogEmbedding, db
+from sqlalchemy import func, select
+from usage import track_call
+
+GEMINI_EMBEDDING_MODEL = 'models/text-embedding-004'
+# Missing vectors fetched per query when syncing an index
+SYNC_CHUNK_SIZE = 500
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-bigrams embedding via signed feature hashing."""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f'hashing-bigram-{dim}'
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = unicodedata.normalize('NFKC', text or '').casefold()
+        for i in range(max(len(text) - 1, 1)):
+            digest = hashlib.blake2b(text[i:i + 2].encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.dim] += 1.0 if value & (1 << 63) else -1.0
+        return _normalized(vector)
+
+
+class GeminiEmbedder:
+    def __init__(self, model=GEMINI_EMBEDDING_MODEL):
+        self.name = model.rsplit('/', 1)[-1]
+        self.model = model
+
+    def embed(self, text):
+        with track_call('embedding', self.name, prompt_chars=len(text or '')):
+            result = get_genai().embed_content(model=self.model, content=text, task_type='semantic_similarity')
+        return _normalized(np.asarray(result['embedding'], dtype=np.float32))
+
+
+def _normalized(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_embedders = {}
+
+
+def get_embedder():
+    backend = current_app.config["EMBEDDING_BACKEND"]
+    if backend not in _embedders:
+        _embedders[backend] = GeminiEmbedder() if backend == 'gemini' else HashingEmbedder(
+            current_app.config["EMBEDDING_DIM"])
+    return _embedders[backend]
+
+
+def embedding_row(log, vector, embedder):
+    """An ActivityLogEmbedding for a (possibly not yet flushed) log."""
+    return ActivityLogEmbedding(log=log, user_id=log.user_id, model=embedder.name,
+                                vector=vector.astype(np.float32).tobytes())
+
+
+def stored_vector(log_id, embedder):
+    """The saved vector of a log for this embedder, or None if it has none."""
+    vector = db.session.scalar(select(ActivityLogEmbedding.vector).where(
+        ActivityLogEmbedding.log_id == log_id, ActivityLogEmbedding.model == embedder.name))
+    return None if vector is None else np.frombuffer(vector, dtype=np.float32)
+
+
+class UserIndex:
+    """One user's normalized vectors as rows of a matrix, plus the log id of each row."""
+
+    def __init__(self):
+        # Preallocated with spare capacity, so appending a vector is amortized O(1)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._matrix = None
+        self.size = 0
+        self.log_ids = set()
+        # (count, max, sum) of the stored log ids the index was last synced with
+        self.version = None
+        self.lock = threading.Lock()
+
+    def extend(self, rows):
+        if not rows:
+            return
+        vectors = np.stack([np.frombuffer(vector, dtype=np.float32) for _, vector in rows])
+        needed = self.size + len(rows)
+        if self._matrix is None or needed > len(self._matrix):
+            capacity = max(needed, 2 * self.size, 64)
+            matrix = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            ids = np.empty(capacity, dtype=np.int64)
+            if self._matrix is not None:
+                matrix[:self.size] = self._matrix[:self.size]
+                ids[:self.size] = self._ids[:self.size]
+            self._matrix, self._ids = matrix, ids
+        self._matrix[self.size:needed] = vectors
+        self._ids[self.size:needed] = [log_id for log_id, _ in rows]
+        self.size = needed
+        self.log_ids.update(log_id for log_id, _ in rows)
+
+    def remove(self, log_ids):
+        if not log_ids:
+            return
+        keep = ~np.isin(self._ids[:self.size], list(log_ids))
+        kept = int(keep.sum())
+        self._matrix[:kept] = self._matrix[:self.size][keep]
+        self._ids[:kept] = self._ids[:self.size][keep]
+        self.size = kept
+        self.log_ids -= set(log_ids)
+
+    def nearest(self, vector, k, exclude_id=None):
+        """Returns [(log_id, similarity)] of the k most similar rows."""
+        if not self.size:
+            return []
+        similarities = self._matrix[:self.size] @ vector
+        if exclude_id is not None:
+            similarities[self._ids[:self.size] == exclude_id] = -np.inf
+        k = min(k, self.size)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind='stable')]
+        return [(int(self._ids[i]), float(similarities[i])) for i in top if np.isfinite(similarities[i])]
+
+
+_indexes = collections.OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _user_index(user_id, model):
+    key = (user_id, model)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = UserIndex()
+        _indexes.move_to_end(key)
+        while len(_indexes) > current_app.config["EMBEDDING_INDEX_MAX_USERS"]:
+            _indexes.popitem(last=False)
+
+    in_index = (ActivityLogEmbedding.user_id == user_id, ActivityLogEmbedding.model == model)
+    with index.lock:
+        # The table is written by any worker (or `flask embed-logs`); an added,
+        # backfilled or deleted vector changes the count, max or sum of the ids
+        version = tuple(db.session.execute(select(
+            func.count(), func.max(ActivityLogEmbedding.log_id), func.sum(ActivityLogEmbedding.log_id)
+        ).where(*in_index)).one())
+        if version == index.version:
+            return index
+        stored = set(db.session.scalars(select(ActivityLogEmbedding.log_id).where(*in_index)))
+        index.remove(index.log_ids - stored)
+        missing = sorted(stored - index.log_ids)
+        for i in range(0, len(missing), SYNC_CHUNK_SIZE):
+            index.extend(db.session.execute(
+                select(ActivityLogEmbedding.log_id, ActivityLogEmbedding.vector).where(
+                    *in_index, ActivityLogEmbedding.log_id.in_(missing[i:i + SYNC_CHUNK_SIZE]))
+            ).all())
+        index.version = version
+    return index
+
+
+def evict_user_indexes(user_id):
+    """Drops this worker's cached vectors of a user, e.g. after their logs are deleted."""
+    with _indexes_lock:
+        for key in [key for key in _indexes if key[0] == user_id]:
+            del _indexes[key]
+
+
+def find_similar_sessions(user_id, vector, k, min_similarity=0.2, exclude_id=None):
+    """Returns [(ActivityLog, similarity)] of the user's most similar past focus logs."""
+    index = _user_index(user_id, get_embedder().name)
+    with index.lock:
+        neighbours = [(log_id, similarity) for log_id, similarity in index.nearest(vector, k, exclude_id)
+                      if similarity >= min_similarity]
+    if not neighbours:
+        return []
+    logs = {log.id: log for log in ActivityLog.query.filter(
+        ActivityLog.id.in_([log_id for log_id, _ in neighbours]))}
+    # A log may have been deleted since the index was synced
+    return [(logs[log_id], similarity) for log_id, similarity in neighbours if log_id in logs]
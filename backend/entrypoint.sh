@@ -13,5 +13,7 @@ flask init-db
 # Start Gunicorn server
 # Using exec means Gunicorn will replace the shell process and become the
 # main process (PID 1), which is important for signal handling.
+# Workers, threads and timeouts are configured in gunicorn.conf.py
+# (set GUNICORN_RELOAD=true for code reloading during development).
 echo "Starting Gunicorn..."
-exec gunicorn --workers 4 --bind 0.0.0.0:$PORT --reload app:app
+exec gunicorn --config gunicorn.conf.py 'app:create_app()'
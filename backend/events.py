@@ -0,0 +1,209 @@
+"""
+Per-user change feed of ActivityLog events ('created', 'deleted', 'scored'),
+streamed to open tabs over Server-Sent Events.
+
+Events carry ids and small deltas only, never a log's text (NOTIFY payloads
+are limited to 8000 bytes); clients fetch the log itself from
+/api/history/<id>. They are collected from flushed sessions and only
+published once the transaction commits:
+  - local: published straight to this process's EventBus after commit.
+    Tabs connected to other workers do not see them.
+  - postgres: sent with pg_notify inside the transaction (Postgres delivers
+    it on commit), and every worker LISTENs and feeds its own EventBus.
+"""
+import collections
+import json
+import logging
+import random
+import select
+import threading
+import time
+
+from admission import Overloaded
+from flask import current_app, has_app_context
+from models import ActivityLog, db
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+NOTIFY_CHANNEL = 'activity_events'
+# Events buffered per subscriber; a slower client gets a 'resync' instead
+SUBSCRIPTION_BUFFER = 100
+
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._events = collections.deque()
+        self._overflowed = False
+        self._cond = threading.Condition()
+
+    def push(self, event_data):
+        with self._cond:
+            if len(self._events) >= SUBSCRIPTION_BUFFER:
+                self._events.clear()
+                self._overflowed = True
+            else:
+                self._events.append(event_data)
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Waits up to `timeout` seconds and returns the pending events (possibly none)."""
+        with self._cond:
+            if not self._events and not self._overflowed:
+                self._cond.wait(timeout)
+            if self._overflowed:
+                self._overflowed = False
+                self._events.clear()
+                return [{'type': 'resync'}]
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+
+class EventBus:
+    """In-process fan-out of events to the subscriptions of each user."""
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, max_streams):
+        with self._lock:
+            if sum(len(subs) for subs in self._subscriptions.values()) >= max_streams:
+                raise Overloaded('events', 'too many streams', 30)
+            subscription = Subscription(user_id)
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subs = self._subscriptions.get(subscription.user_id, set())
+            subs.discard(subscription)
+            if not subs:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id, event_data):
+        with self._lock:
+            subs = list(self._subscriptions.get(user_id, ()))
+        for subscription in subs:
+            subscription.push(event_data)
+
+
+bus = EventBus()
+
+
+def _events_backend():
+    return current_app.config["EVENTS_BACKEND"] if has_app_context() else None
+
+
+def queue_event(session, user_id, event_data):
+    """
+    Publishes an event once `session` commits. For changes the flush hook
+    cannot see, e.g. bulk query.delete().
+    """
+    if _events_backend() == 'postgres':
+        session.connection().execute(text("SELECT pg_notify(:channel, :payload)"), {
+            "channel": NOTIFY_CHANNEL,
+            "payload": json.dumps({"user_id": user_id, "event": event_data}, ensure_ascii=False),
+        })
+    else:
+        session.info.setdefault('pending_events', []).append((user_id, event_data))
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_activity_events(session, flush_context):
+    if _events_backend() is None:
+        return
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, ActivityLog):
+            changes.append((obj.user_id, {'type': 'created', 'log_id': obj.id, 'log_type': obj.log_type}))
+    for obj in session.dirty:
+        if isinstance(obj, ActivityLog) and inspect(obj).attrs.score.history.has_changes():
+            changes.append((obj.user_id, {'type': 'scored', 'log_id': obj.id, 'score': obj.score}))
+    for obj in session.deleted:
+        if isinstance(obj, ActivityLog):
+            changes.append((obj.user_id, {'type': 'deleted', 'log_id': obj.id}))
+    for user_id, event_data in changes:
+        queue_event(session, user_id, event_data)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_activity_events(session):
+    for user_id, event_data in session.info.pop('pending_events', []):
+        bus.publish(user_id, event_data)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_activity_events(session):
+    session.info.pop('pending_events', None)
+
+
+# --- Postgres LISTEN ---
+_listener_lock = threading.Lock()
+_listener_thread = None
+
+
+def _listen(engine):
+    """Forwards NOTIFY payloads to this process's bus; reconnects on errors."""
+    while True:
+        try:
+            raw = engine.raw_connection()
+            raw.detach()  # Never returned to the pool
+            connection = raw.driver_connection
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            while True:
+                if select.select([connection], [], [], 5) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    message = json.loads(notify.payload)
+                    bus.publish(message["user_id"], message["event"])
+        except Exception as e:
+            logging.error(f"Activity event listener failed, reconnecting: {e}")
+            time.sleep(1)
+
+
+def ensure_listener():
+    """Starts this worker's LISTEN thread on first use (i.e. after the fork)."""
+    global _listener_thread
+    if current_app.config["EVENTS_BACKEND"] != 'postgres' or _listener_thread is not None:
+        return
+    with _listener_lock:
+        if _listener_thread is None:
+            _listener_thread = threading.Thread(
+                target=_listen, args=(db.engine,), name='activity-event-listener', daemon=True)
+            _listener_thread.start()
+
+
+# --- SSE ---
+def open_stream(user_id):
+    ensure_listener()
+    return bus.subscribe(user_id, current_app.config["EVENTS_MAX_STREAMS"])
+
+
+def retry_later(seconds):
+    """A complete SSE response that makes EventSource reconnect after ~`seconds` (jittered)."""
+    return f"retry: {int(seconds * 1000 * random.uniform(1, 2))}\n\n"
+
+
+def sse_stream(subscription, max_seconds, heartbeat_seconds):
+    """
+    Yields SSE frames until `max_seconds` have passed; EventSource then
+    reconnects on its own, which bounds how long a worker thread is held.
+    """
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield "retry: 3000\n\n"
+        while time.monotonic() < deadline:
+            events = subscription.get(min(heartbeat_seconds, max(deadline - time.monotonic(), 0)))
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event_data in events:
+                yield f"data: {json.dumps(event_data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+    finally:
+        bus.unsubscribe(subscription)
@@ -0,0 +1,143 @@
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import current_app
+from models import ActivityLog, WeeklyFeedback, db
+from prompts import CONTEXT_DELIMITER, generate
+from sqlalchemy import func, or_
+
+# Feedback covers the logs of the last FEEDBACK_WINDOW_DAYS days
+FEEDBACK_WINDOW_DAYS = 7
+# Fewer logs than this in the window are not enough to say anything useful
+MIN_FEEDBACK_LOGS = 2
+NOT_ENOUGH_LOGS_MESSAGE = 'フィードバックを生成するには、少なくとも2日以上の記録が必要です。'
+
+
+def feedback_window(today=None):
+    end_date = today or datetime.datetime.utcnow().date()
+    return end_date - datetime.timedelta(days=FEEDBACK_WINDOW_DAYS), end_date
+
+
+def _stale_before():
+    max_age = current_app.config["FEEDBACK_MAX_AGE_HOURS"]
+    return datetime.datetime.utcnow() - datetime.timedelta(hours=max_age)
+
+
+def latest_log_id(user_id):
+    return db.session.query(func.max(ActivityLog.id)).filter(
+        ActivityLog.user_id == user_id).scalar() or 0
+
+
+def get_stored_feedback(user_id, last_log_id):
+    """Returns the stored feedback if no log was added since and it is not too old, else None."""
+    stored = db.session.get(WeeklyFeedback, user_id)
+    if stored is None or stored.last_log_id < last_log_id or stored.generated_at < _stale_before():
+        return None
+    return stored
+
+
+def store_feedback(user_id, feedback, last_log_id):
+    """Inserts or replaces the user's stored feedback (added to the session, not committed)."""
+    stored = db.session.get(WeeklyFeedback, user_id) or WeeklyFeedback(user_id=user_id)
+    stored.feedback = feedback
+    stored.last_log_id = last_log_id
+    stored.generated_at = datetime.datetime.utcnow()
+    db.session.add(stored)
+    return stored
+
+
+def has_enough_logs(insights):
+    return insights['focus_sessions'] + insights['life_logs'] >= MIN_FEEDBACK_LOGS
+
+
+def generate_feedback_text(insights, user_id=None):
+    """Asks the AI for coaching feedback on pre-computed statistics (not the raw logs)."""
+    from insights import format_insights_for_prompt
+    summary_text = format_insights_for_prompt(insights)
+    return generate('weekly_feedback', f"{CONTEXT_DELIMITER}\n{summary_text}", user_id).text
+
+
+class RateLimiter:
+    """Spaces out calls shared by several threads to at most `per_minute` per minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self._next_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def find_feedback_candidates(since):
+    """
+    Returns [(user_id, latest log id)] for users who logged something since
+    `since` and whose stored feedback is missing, outdated by newer logs, or too old.
+    """
+    latest = db.session.query(
+        ActivityLog.user_id, func.max(ActivityLog.id).label('last_log_id')
+    ).filter(ActivityLog.created_at >= since).group_by(ActivityLog.user_id).subquery()
+
+    rows = db.session.query(latest.c.user_id, latest.c.last_log_id).outerjoin(
+        WeeklyFeedback, WeeklyFeedback.user_id == latest.c.user_id
+    ).filter(or_(
+        WeeklyFeedback.user_id.is_(None),
+        WeeklyFeedback.last_log_id < latest.c.last_log_id,
+        WeeklyFeedback.generated_at < _stale_before(),
+    )).order_by(latest.c.user_id).all()
+    return [(row.user_id, row.last_log_id) for row in rows]
+
+
+def _generate_in_app(app, limiter, insights, user_id):
+    limiter.wait()
+    with app.app_context():
+        return generate_feedback_text(insights, user_id)
+
+
+def pregenerate_feedback(load_insights, workers=4, requests_per_minute=30, limit=None):
+    """
+    Generates and stores feedback for every candidate user. Insights are
+    loaded and results written on the calling thread; only the AI calls run
+    in the pool, spaced out by a shared rate limit.
+    `load_insights(user_id, start_date, end_date)` computes the statistics.
+    Returns (generated, skipped, failed) counts.
+    """
+    app = current_app._get_current_object()
+    start_date, end_date = feedback_window()
+    since = datetime.datetime.combine(start_date, datetime.time.min)
+    candidates = find_feedback_candidates(since)
+    if limit:
+        candidates = candidates[:limit]
+
+    generated = skipped = failed = 0
+    limiter = RateLimiter(requests_per_minute)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for user_id, last_log_id in candidates:
+            insights = load_insights(user_id, start_date, end_date)
+            if not has_enough_logs(insights):
+                skipped += 1
+                continue
+            futures[executor.submit(_generate_in_app, app, limiter, insights, user_id)] = (user_id, last_log_id)
+
+        for future in as_completed(futures):
+            user_id, last_log_id = futures[future]
+            try:
+                store_feedback(user_id, future.result(), last_log_id)
+                db.session.commit()
+                generated += 1
+            except Exception as e:
+                db.session.rollback()
+                failed += 1
+                logging.error(f"Error pre-generating feedback for user {user_id}: {e}")
+
+    logging.info(f"Pre-generated feedback for {generated} users ({skipped} skipped, {failed} failed)")
+    return generated, skipped, failed
@@ -0,0 +1,94 @@
+"""
+Gunicorn server configuration (loaded automatically from the working directory).
+
+    gunicorn 'app:create_app()'
+
+Every setting can be overridden with a GUNICORN_* environment variable.
+Worker classes:
+  - gthread (default): a few processes with a thread pool each. Threads wait
+    on Gemini calls without blocking cheap routes.
+  - gevent: cooperative workers for very high concurrency. Requires the
+    `gevent` package (and `psycogreen` for non-blocking Postgres access).
+  - sync: one request per process; only for debugging.
+See benchmarks/bench_worker_modes.py for a comparison under our request mix.
+"""
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    return value.lower() in ("1", "true", "yes") if value else default
+
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+if worker_class == "gevent":
+    # One process per core; each handles many requests waiting on I/O
+    workers = _env_int("GUNICORN_WORKERS", cpu_count)
+    worker_connections = _env_int("GUNICORN_WORKER_CONNECTIONS", 200)
+    # Preloading imports ssl/threading before gevent patches them
+    preload_app = _env_bool("GUNICORN_PRELOAD", False)
+elif worker_class == "gthread":
+    workers = _env_int("GUNICORN_WORKERS", cpu_count + 1)
+    # Most request time is spent waiting on the LLM, so oversubscribe threads.
+    # AI slots + AI queue + SSE streams (see app.py) must leave some for reads
+    threads = _env_int("GUNICORN_THREADS", 12)
+    preload_app = _env_bool("GUNICORN_PRELOAD", True)
+else:
+    workers = _env_int("GUNICORN_WORKERS", 2 * cpu_count + 1)
+    preload_app = _env_bool("GUNICORN_PRELOAD", True)
+
+# Recycle workers to bound memory growth; jitter avoids restarting them all at once
+max_requests = _env_int("GUNICORN_MAX_REQUESTS", 1000)
+max_requests_jitter = _env_int("GUNICORN_MAX_REQUESTS_JITTER", 100)
+
+# Chat turns can make two Gemini calls in a row, so allow long requests and
+# give in-flight calls time to finish on shutdown/reload
+timeout = _env_int("GUNICORN_TIMEOUT", 120)
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", 90)
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+
+# Code reloading is for local development only (incompatible with preload)
+reload = _env_bool("GUNICORN_RELOAD", False)
+if reload:
+    preload_app = False
+
+# Set GUNICORN_ACCESSLOG to an empty value to disable access logging
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-") or None
+
+
+def post_fork(server, worker):
+    """Re-initializes state that must not be shared with the master process."""
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed; Postgres calls will block gevent workers")
+
+    if preload_app:
+        # The master may already hold a Gemini client, whose gRPC channels
+        # are not fork-safe. Without preload nothing was imported yet, and
+        # importing it here would load ssl/threading before gevent patches them
+        from ai_client import reset_client
+        from prompts import reset_models
+        reset_client()
+        reset_models()
+
+        # Drop pooled connections inherited from the master without closing
+        # them, so the master's sockets are left untouched
+        flask_app = worker.app.wsgi()
+        if "sqlalchemy" in getattr(flask_app, "extensions", {}):
+            from models import db
+            with flask_app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose(close=False)
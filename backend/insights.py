@@ -0,0 +1,207 @@
+import datetime
+
+import numpy as np
+
+# Minimum number of paired days before a correlation is reported
+MIN_CORRELATION_SAMPLES = 3
+# Minimum number of sessions in an hour before it can be a "best hour"
+MIN_HOUR_SAMPLES = 2
+
+
+def _as_float(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def build_focus_series(rows):
+    """Converts (created_at, score, duration_minutes) rows of 'focus' logs into columnar arrays."""
+    created_at = [row[0] for row in rows]
+    return {
+        "created_at": np.array(created_at, dtype="datetime64[s]"),
+        "score": np.array([_as_float(row[1]) for row in rows], dtype=float),
+        "duration_minutes": np.array([_as_float(row[2]) for row in rows], dtype=float),
+    }
+
+
+def build_life_series(rows):
+    """Converts (created_at, sleep_hours, screen_time, mood) rows of 'life' logs into columnar arrays."""
+    created_at = [row[0] for row in rows]
+    return {
+        "created_at": np.array(created_at, dtype="datetime64[s]"),
+        "sleep_hours": np.array([_as_float(row[1]) for row in rows], dtype=float),
+        "screen_time": np.array([_as_float(row[2]) for row in rows], dtype=float),
+        "mood": np.array([_as_float(row[3]) for row in rows], dtype=float),
+    }
+
+
+def _day_index(created_at, start_date, num_days):
+    days = (created_at.astype("datetime64[D]") - np.datetime64(start_date, "D")).astype(int)
+    return days, (days >= 0) & (days < num_days)
+
+
+def _daily_mean(day_index, values, num_days):
+    valid = ~np.isnan(values)
+    sums = np.bincount(day_index[valid], weights=values[valid], minlength=num_days)
+    counts = np.bincount(day_index[valid], minlength=num_days)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _daily_latest(day_index, created_at, values, num_days):
+    """Picks the value of the latest log of each day (NaN for days without logs)."""
+    result = np.full(num_days, np.nan)
+    if day_index.size == 0:
+        return result
+    order = np.argsort(created_at, kind="stable")
+    # Later assignments win, so writing in chronological order keeps the latest
+    result[day_index[order]] = values[order]
+    return result
+
+
+def rolling_mean(values, window):
+    """NaN-aware trailing rolling mean."""
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0))
+    counts = np.cumsum(valid)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def correlation(x, y):
+    """Pearson correlation over days where both values exist, or None."""
+    mask = ~np.isnan(x) & ~np.isnan(y)
+    if mask.sum() < MIN_CORRELATION_SAMPLES:
+        return None
+    x, y = x[mask], y[mask]
+    if np.std(x) == 0 or np.std(y) == 0:
+        return None
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+def best_hours(created_at, scores, top=3):
+    """Returns the hours of day (UTC) with the highest average session score."""
+    valid = ~np.isnan(scores)
+    if not valid.any():
+        return []
+    hours = (created_at[valid].astype("datetime64[h]") - created_at[valid].astype("datetime64[D]")).astype(int)
+    sums = np.bincount(hours, weights=scores[valid], minlength=24)
+    counts = np.bincount(hours, minlength=24)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = np.where(counts >= MIN_HOUR_SAMPLES, sums / counts, np.nan)
+    candidates = np.flatnonzero(~np.isnan(averages))
+    ranked = candidates[np.argsort(-averages[candidates], kind="stable")][:top]
+    return [
+        {"hour": int(hour), "avg_score": round(float(averages[hour]), 1), "sessions": int(counts[hour])}
+        for hour in ranked
+    ]
+
+
+def _rounded(values, digits=1):
+    if digits == 0:
+        return [None if np.isnan(v) else int(round(float(v))) for v in values]
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def _round_or_none(value, digits=2):
+    return None if value is None else round(value, digits)
+
+
+def _nanmean_or_none(values, digits=1):
+    if np.isnan(values).all():
+        return None
+    return round(float(np.nanmean(values)), digits)
+
+
+def compute_insights(focus, life, start_date, end_date, window=7):
+    """
+    Computes per-day series, rolling averages, correlations and best hours
+    from columnar focus/life series (see build_focus_series/build_life_series).
+    """
+    num_days = (end_date - start_date).days + 1
+
+    focus_days, focus_in_range = _day_index(focus["created_at"], start_date, num_days)
+    life_days, life_in_range = _day_index(life["created_at"], start_date, num_days)
+
+    daily_score = _daily_mean(focus_days[focus_in_range], focus["score"][focus_in_range], num_days)
+    duration = focus["duration_minutes"][focus_in_range]
+    daily_duration = np.bincount(
+        focus_days[focus_in_range], weights=np.nan_to_num(duration), minlength=num_days)
+    daily_sessions = np.bincount(focus_days[focus_in_range], minlength=num_days)
+
+    life_created = life["created_at"][life_in_range]
+    daily_sleep = _daily_latest(life_days[life_in_range], life_created, life["sleep_hours"][life_in_range], num_days)
+    daily_screen = _daily_latest(life_days[life_in_range], life_created, life["screen_time"][life_in_range], num_days)
+    daily_mood = _daily_latest(life_days[life_in_range], life_created, life["mood"][life_in_range], num_days)
+
+    dates = [(start_date + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range(num_days)]
+
+    return {
+        "start_date": dates[0],
+        "end_date": dates[-1],
+        "focus_sessions": int(focus_in_range.sum()),
+        "life_logs": int(life_in_range.sum()),
+        "summary": {
+            "avg_score": _nanmean_or_none(focus["score"][focus_in_range]),
+            "avg_daily_focus_minutes": round(float(daily_duration.mean()), 1) if num_days else None,
+            "avg_sleep_hours": _nanmean_or_none(daily_sleep),
+            "avg_screen_time": _nanmean_or_none(daily_screen),
+            "avg_mood": _nanmean_or_none(daily_mood),
+        },
+        "correlations": {
+            "sleep_vs_score": _round_or_none(correlation(daily_sleep, daily_score)),
+            "screen_time_vs_score": _round_or_none(correlation(daily_screen, daily_score)),
+            "mood_vs_score": _round_or_none(correlation(daily_mood, daily_score)),
+        },
+        "best_hours": best_hours(focus["created_at"][focus_in_range], focus["score"][focus_in_range]),
+        "daily": {
+            "date": dates,
+            "score": _rounded(daily_score),
+            "total_duration": [int(v) for v in daily_duration],
+            "sessions": [int(v) for v in daily_sessions],
+            "sleep_hours": _rounded(daily_sleep),
+            "screen_time": _rounded(daily_screen, 0),
+            "mood": _rounded(daily_mood, 0),
+            "rolling_score": _rounded(rolling_mean(daily_score, window)),
+            "rolling_duration": _rounded(rolling_mean(np.where(daily_sessions > 0, daily_duration, np.nan), window)),
+            "rolling_sleep_hours": _rounded(rolling_mean(daily_sleep, window)),
+        },
+    }
+
+
+def _describe_correlation(value):
+    if value is None:
+        return "データ不足"
+    strength = "強い" if abs(value) >= 0.6 else "中程度の" if abs(value) >= 0.3 else "弱い"
+    direction = "正の" if value >= 0 else "負の"
+    return f"{value:+.2f}（{strength}{direction}相関）"
+
+
+def format_insights_for_prompt(insights):
+    """Renders computed insights as a compact text block for the AI prompt."""
+    summary = insights["summary"]
+    correlations = insights["correlations"]
+    lines = [
+        f"- 期間: {insights['start_date']} 〜 {insights['end_date']}",
+        f"- 集中セッション数: {insights['focus_sessions']}回, 生活ログ数: {insights['life_logs']}件",
+        f"- 平均スコア: {summary['avg_score']}, 1日あたり平均集中時間: {summary['avg_daily_focus_minutes']}分",
+        f"- 平均睡眠時間: {summary['avg_sleep_hours']}時間, 平均スマホ時間: {summary['avg_screen_time']}分, 平均気分: {summary['avg_mood']}/5",
+        f"- 睡眠時間とスコアの相関: {_describe_correlation(correlations['sleep_vs_score'])}",
+        f"- スマホ時間とスコアの相関: {_describe_correlation(correlations['screen_time_vs_score'])}",
+        f"- 気分とスコアの相関: {_describe_correlation(correlations['mood_vs_score'])}",
+    ]
+    if insights["best_hours"]:
+        hours = ", ".join(f"{h['hour']}時台(平均{h['avg_score']}点)" for h in insights["best_hours"])
+        lines.append(f"- スコアが高い時間帯(UTC): {hours}")
+
+    daily = insights["daily"]
+    for i, date in enumerate(daily["date"]):
+        if daily["sessions"][i] == 0 and daily["sleep_hours"][i] is None:
+            continue
+        lines.append(
+            f"  - {date}: スコア {daily['score'][i]}, 集中 {daily['total_duration'][i]}分, "
+            f"睡眠 {daily['sleep_hours'][i]}時間, スマホ {daily['screen_time'][i]}分, 気分 {daily['mood'][i]}")
+    return "\n".join(lines)
@@ -0,0 +1,14 @@
+"""
+Entry point for one-shot management jobs, e.g. database migrations:
+
+    FLASK_APP=manage.py flask db upgrade
+
+Flask-Migrate is only loaded here, so web workers don't pay for it at startup.
+"""
+from flask_migrate import Migrate
+
+from app import create_app
+from models import db
+
+app = create_app()
+migrate = Migrate(app, db)
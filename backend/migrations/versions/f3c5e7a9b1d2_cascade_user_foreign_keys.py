@@ -0,0 +1,42 @@
+"""Cascade deletes from users to the rows they own
+
+Revision ID: f3c5e7a9b1d2
+Revises: e2b4d6f8a0c1
+Create Date: 2025-12-23 16:40:12.527384
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c5e7a9b1d2'
+down_revision = 'e2b4d6f8a0c1'
+branch_labels = None
+depends_on = None
+
+USER_FOREIGN_KEYS = [
+    'activity_log',
+    'ai_usage_logs',
+    'user_daily_summaries',
+    'chat_conversations',
+    'weekly_feedback',
+]
+# The constraints were created unnamed; this is the name Postgres gave them,
+# and lets batch mode name the reflected constraints the same way on SQLite
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+def _recreate_user_foreign_keys(ondelete):
+    for table in USER_FOREIGN_KEYS:
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(f'{table}_user_id_fkey', type_='foreignkey')
+            batch_op.create_foreign_key(
+                f'{table}_user_id_fkey', 'users', ['user_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _recreate_user_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _recreate_user_foreign_keys(None)
@@ -1,6 +1,7 @@
 import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 
 db = SQLAlchemy() # This will be initialized by app.py
 
@@ -10,20 +11,168 @@ class User(UserMixin, db.Model):
     google_id = db.Column(db.String(128), unique=True, nullable=False)
     email = db.Column(db.String(128), unique=True, nullable=False)
     name = db.Column(db.String(128), nullable=True)
-    activity_logs = db.relationship('ActivityLog', backref='user', lazy=True)
-    ai_usage_logs = db.relationship('AiUsageLog', backref='user', lazy=True)
+    # Rows are removed by ON DELETE CASCADE, not loaded and deleted one by one (see deletion.py)
+    activity_logs = db.relationship('ActivityLog', backref='user', lazy=True, passive_deletes=True)
+    ai_usage_logs = db.relationship('AiUsageLog', backref='user', lazy=True, passive_deletes=True)
 
 
 class ActivityLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
     log_type = db.Column(db.String, nullable=False)
-    data = db.Column(db.JSON, nullable=False)
+    data = db.Column(db.JSON, nullable=False)  # Validated payload, see schemas.py
+
+    # Numeric fields of `data`, mirrored into typed columns for aggregation
+    score = db.Column(db.Integer, nullable=True)
+    duration_minutes = db.Column(db.Integer, nullable=True)
+    focus_level = db.Column(db.Integer, nullable=True)
+    sleep_hours = db.Column(db.Float, nullable=True)
+    screen_time = db.Column(db.Integer, nullable=True)
+    mood = db.Column(db.Integer, nullable=True)
+
+    NUMERIC_FIELDS = ('score', 'duration_minutes', 'focus_level', 'sleep_hours', 'screen_time', 'mood')
+
+    @validates('data')
+    def _sync_numeric_columns(self, key, data):
+        """Keeps the typed columns in step whenever `data` is (re)assigned."""
+        for field in self.NUMERIC_FIELDS:
+            setattr(self, field, (data or {}).get(field))
+        return data
 
 class AiUsageLog(db.Model):
     __tablename__ = 'ai_usage_logs'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     used_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
     feature_type = db.Column(db.String(50), nullable=False) # 'focus' or 'lounge'
+
+
+# --- Analytics Summary Tables (written by the `flask run-analytics` job) ---
+
+class AnalyticsWatermark(db.Model):
+    """One row per job; locked while the job runs, so runs never overlap."""
+    __tablename__ = 'analytics_watermarks'
+    job_name = db.Column(db.String(50), primary_key=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class AnalyticsLogChange(db.Model):
+    """
+    A change not yet applied to the summary tables, written in the same
+    transaction as the log change: sign +1 adds a log as it now is, -1
+    removes the values that were added before (see analytics.py).
+    """
+    __tablename__ = 'analytics_log_changes'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    log_id = db.Column(db.Integer, nullable=False)  # No foreign key: removals outlive the log
+    user_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    log_type = db.Column(db.String, nullable=False)
+    score = db.Column(db.Integer, nullable=True)
+    duration_minutes = db.Column(db.Integer, nullable=True)
+    sign = db.Column(db.SmallInteger, nullable=False)
+
+
+class UserDailySummary(db.Model):
+    __tablename__ = 'user_daily_summaries'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    focus_sessions = db.Column(db.Integer, nullable=False, default=0)
+    focus_minutes = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0)
+    score_count = db.Column(db.Integer, nullable=False, default=0)
+    life_logs = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ScoreHistogram(db.Model):
+    __tablename__ = 'score_histograms'
+    date = db.Column(db.Date, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)  # 0-9: score // 10, 10: score 100
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CohortDailySummary(db.Model):
+    __tablename__ = 'cohort_daily_summaries'
+    date = db.Column(db.Date, primary_key=True)
+    active_users = db.Column(db.Integer, nullable=False, default=0)
+    focus_users = db.Column(db.Integer, nullable=False, default=0)
+    avg_focus_minutes = db.Column(db.Float, nullable=True)  # per focus user
+    avg_score = db.Column(db.Float, nullable=True)
+
+
+class StreakRetention(db.Model):
+    __tablename__ = 'streak_retention'
+    streak_length = db.Column(db.Integer, primary_key=True)  # capped bucket, see analytics.py
+    users = db.Column(db.Integer, nullable=False, default=0)
+    retained_users = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class ChatConversation(db.Model):
+    """Server-side state of a focus/lounge chat, so clients only send new messages."""
+    __tablename__ = 'chat_conversations'
+    id = db.Column(db.String(36), primary_key=True)  # UUID4, handed to the client
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'focus' or 'lounge'
+    turns = db.Column(db.JSON, nullable=False, default=list)  # [{"sender": ..., "text": ...}]
+    summary = db.Column(db.Text, nullable=True)  # Rolling summary of turns folded out of `turns`
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class WeeklyFeedback(db.Model):
+    """Latest AI coaching feedback per user (pre-generated nightly by `flask pregenerate-feedback`)."""
+    __tablename__ = 'weekly_feedback'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    feedback = db.Column(db.Text, nullable=False)
+    last_log_id = db.Column(db.Integer, nullable=False)  # Newest ActivityLog the feedback covers
+    generated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class ActivityLogNgram(db.Model):
+    """Search index: character n-grams of an ActivityLog's text fields (maintained by search.py)."""
+    __tablename__ = 'activity_log_ngrams'
+    user_id = db.Column(db.Integer, primary_key=True)
+    gram = db.Column(db.String(8), primary_key=True)
+    log_id = db.Column(db.Integer, db.ForeignKey('activity_log.id', ondelete='CASCADE'), primary_key=True, index=True)
+    field = db.Column(db.SmallInteger, primary_key=True)  # Index into search.SEARCH_FIELDS
+
+
+class ActivityLogEmbedding(db.Model):
+    """Embedding of a focus log's task_content (float32 bytes, L2-normalized; see embeddings.py)."""
+    __tablename__ = 'activity_log_embeddings'
+    log_id = db.Column(db.Integer, db.ForeignKey('activity_log.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    model = db.Column(db.String(50), nullable=False)  # Vectors of different models are never compared
+    vector = db.Column(db.LargeBinary, nullable=False)
+    log = db.relationship('ActivityLog')
+
+
+class AiCallLog(db.Model):
+    """One model call (buffered in memory and written in batches by usage.py)."""
+    __tablename__ = 'ai_call_logs'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=True, index=True)
+    feature = db.Column(db.String(30), nullable=False)  # Prompt name, e.g. 'focus_scoring'
+    model = db.Column(db.String(40), nullable=False)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cached_tokens = db.Column(db.Integer, nullable=False, default=0)  # Part of input_tokens
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    latency_ms = db.Column(db.Integer, nullable=False)
+    outcome = db.Column(db.String(10), nullable=False)  # 'ok' or 'error'
+
+
+class AiUsageDaily(db.Model):
+    """Per-user, per-feature daily totals of AiCallLog (kept after raw calls are pruned)."""
+    __tablename__ = 'ai_usage_daily'
+    date = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    feature = db.Column(db.String(30), primary_key=True)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    input_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    cached_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    output_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    latency_ms = db.Column(db.BigInteger, nullable=False, default=0)  # Sum; divide by calls
@@ -0,0 +1,92 @@
+import datetime
+import decimal
+import gzip
+import json
+
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Only gzip is offered
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html", "text/csv"}
+
+
+def _default(obj):
+    """Encodes the types our routes return besides plain JSON values."""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson when it is installed. Datetimes are
+    encoded as ISO 8601 (like datetime.isoformat()), so routes can return
+    them as-is. Non-ASCII text (Japanese) is written unescaped.
+    """
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+        kwargs.setdefault("default", _default)
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is not None and not self._app.debug:
+            body = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+            return self._app.response_class(body, mimetype=self.mimetype)
+        # Debug responses are pretty-printed by the default provider
+        return super().response(obj)
+
+
+def compress(body, encoding, level=None):
+    """Compresses a response body with 'br' or 'gzip'."""
+    if encoding == "br":
+        return brotli.compress(body, quality=4 if level is None else level)
+    return gzip.compress(body, compresslevel=5 if level is None else level, mtime=0)
+
+
+def negotiate_encoding(accept_encodings):
+    """Picks 'br' or 'gzip' from the client's Accept-Encoding, or None."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_response(response):
+    """after_request hook compressing text responses above COMPRESSION_MIN_BYTES."""
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.is_streamed
+            or response.direct_passthrough or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+
+    min_bytes = current_app.config["COMPRESSION_MIN_BYTES"]
+    if not min_bytes or response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if response.content_length is not None and response.content_length < min_bytes:
+        return response
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    level = current_app.config["COMPRESSION_BROTLI_QUALITY" if encoding == "br" else "COMPRESSION_GZIP_LEVEL"]
+    response.set_data(compress(response.get_data(), encoding, level))
+    response.headers["Content-Encoding"] = encoding
+    return response
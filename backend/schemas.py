@@ -0,0 +1,182 @@
+import json
+from dataclasses import asdict, dataclass
+
+
+def _number(data, key, kind, minimum=None, maximum=None):
+    value = data.get(key)
+    if value is None or isinstance(value, bool):
+        raise ValueError(f"'{key}' is required and must be a number")
+    try:
+        value = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{key}' must be a number, got {value!r}")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ValueError(f"'{key}' must be between {minimum} and {maximum}, got {value}")
+    return value
+
+
+def _optional_number(data, key, kind, minimum=None, maximum=None):
+    return None if data.get(key) is None else _number(data, key, kind, minimum, maximum)
+
+
+def _optional_string(data, key):
+    value = data.get(key)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"'{key}' must be a string")
+    return value
+
+
+def parse_score(value):
+    """Coerces a score (the AI may return it as a string) to an int in 0-100."""
+    return int(round(_number({'score': value}, 'score', float, 0, 100)))
+
+
+@dataclass(frozen=True)
+class FocusLog:
+    """Payload of a 'focus' ActivityLog."""
+    task_content: str
+    duration_minutes: int
+    focus_level: int | None = None  # 1-5, not asked in quick mode
+    score: int | None = None  # 0-100, filled in by scoring
+    ai_feedback: str | None = None
+    score_source: str | None = None  # 'llm' or 'heuristic'
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError("focus log data must be an object")
+        task_content = _optional_string(data, 'task_content')
+        if not task_content or not task_content.strip():
+            raise ValueError("'task_content' is required")
+        focus_level = _optional_number(data, 'focus_level', float, 1, 5)
+        score = data.get('score')
+        return cls(
+            task_content=task_content.strip(),
+            duration_minutes=int(round(_number(data, 'duration_minutes', float, 0, 24 * 60))),
+            focus_level=None if focus_level is None else int(round(focus_level)),
+            score=None if score is None else parse_score(score),
+            ai_feedback=_optional_string(data, 'ai_feedback'),
+            score_source=_optional_string(data, 'score_source'),
+        )
+
+    def to_dict(self):
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+
+@dataclass(frozen=True)
+class LifeLog:
+    """Payload of a 'life' ActivityLog."""
+    sleep_hours: float
+    screen_time: int  # minutes
+    mood: int  # 1-5
+    ai_advice: str | None = None
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError("life log data must be an object")
+        ai_advice = _optional_string(data, 'ai_advice')
+        return cls(
+            sleep_hours=round(_number(data, 'sleep_hours', float, 0, 24), 1),
+            screen_time=int(round(_number(data, 'screen_time', float, 0, 24 * 60))),
+            mood=int(round(_number(data, 'mood', float, 1, 5))),
+            ai_advice=ai_advice,
+        )
+
+    def to_dict(self):
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+
+LOG_SCHEMAS = {'focus': FocusLog, 'life': LifeLog}
+
+
+def validate_log_data(log_type, data):
+    """Validates and normalizes the payload of a log; raises ValueError if invalid."""
+    if log_type not in LOG_SCHEMAS:
+        raise ValueError(f"Unknown log_type '{log_type}'")
+    return LOG_SCHEMAS[log_type].from_dict(data).to_dict()
+
+
+# --- Structured AI Responses ---
+
+# response_schema for lounge_chat: the reply text plus the life log once complete
+LOUNGE_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reply": {"type": "string"},
+        "life_log": {
+            "type": "object",
+            "nullable": True,
+            "properties": {
+                "sleep_hours": {"type": "number"},
+                "screen_time": {"type": "integer"},
+                "mood": {"type": "integer"},
+                "ai_advice": {"type": "string"},
+            },
+            "required": ["sleep_hours", "screen_time", "mood", "ai_advice"],
+        },
+    },
+    "required": ["reply"],
+}
+
+
+class JsonObjectExtractor:
+    """
+    Incrementally finds complete top-level JSON objects in a text stream.
+    Chunks can be fed as they arrive; each character is scanned once, and
+    braces inside strings are ignored.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        """Consumes a chunk and returns the objects completed within it."""
+        objects = []
+        for char in chunk:
+            if self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                    self._buffer = [char]
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        objects.append(json.loads(''.join(self._buffer)))
+                    except json.JSONDecodeError:
+                        pass
+                    self._buffer = []
+        return objects
+
+
+def parse_structured_response(text):
+    """
+    Parses a structured (JSON) model response. Falls back to the first JSON
+    object embedded in the text if the model wrapped it in prose or fences.
+    Returns a dict, or None if no object is found.
+    """
+    try:
+        result = json.loads(text)
+        if isinstance(result, dict):
+            return result
+    except json.JSONDecodeError:
+        pass
+    objects = JsonObjectExtractor().feed(text)
+    return objects[0] if objects else None
@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+from functools import lru_cache
+
+# Default model path, relative to the backend directory
+DEFAULT_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "scoring_model.json")
+
+# Values used when an input is missing (e.g. quick mode has no focus_level)
+DEFAULT_FOCUS_LEVEL = 3
+DEFAULT_SLEEP_HOURS = 7.0
+DEFAULT_MOOD = 3
+IDEAL_SLEEP_HOURS = 7.5
+MAX_COUNTED_MINUTES = 120
+
+FEATURE_NAMES = ("duration_hours", "focus_level", "sleep_deviation", "mood")
+
+# Hand-tuned weights used until a model has been fitted on real data
+DEFAULT_INTERCEPT = 30.0
+DEFAULT_WEIGHTS = (20.0, 7.0, -3.0, 2.0)
+
+
+def _to_float(value, default):
+    try:
+        return float(value) if value is not None else float(default)
+    except (TypeError, ValueError):
+        return float(default)
+
+
+def extract_features(duration_minutes, focus_level=None, sleep_hours=None, mood=None):
+    """Turns the raw session/life values into the model's feature vector."""
+    duration = max(0.0, min(_to_float(duration_minutes, 0), MAX_COUNTED_MINUTES))
+    return (
+        duration / 60.0,
+        _to_float(focus_level, DEFAULT_FOCUS_LEVEL),
+        abs(_to_float(sleep_hours, DEFAULT_SLEEP_HOURS) - IDEAL_SLEEP_HOURS),
+        _to_float(mood, DEFAULT_MOOD),
+    )
+
+
+class HeuristicScorer:
+    """Deterministic linear scoring model for focus sessions."""
+
+    def __init__(self, intercept=DEFAULT_INTERCEPT, weights=DEFAULT_WEIGHTS, samples=0):
+        if len(weights) != len(FEATURE_NAMES):
+            raise ValueError(f"Expected {len(FEATURE_NAMES)} weights, got {len(weights)}")
+        self.intercept = float(intercept)
+        self.weights = tuple(float(w) for w in weights)
+        self.samples = samples
+
+    def score(self, duration_minutes, focus_level=None, sleep_hours=None, mood=None):
+        features = extract_features(duration_minutes, focus_level, sleep_hours, mood)
+        raw = self.intercept + sum(w * x for w, x in zip(self.weights, features))
+        return int(round(max(0.0, min(100.0, raw))))
+
+    @staticmethod
+    def feedback(score):
+        if score >= 80:
+            return "素晴らしい集中でした！この調子で進めましょう。"
+        if score >= 60:
+            return "良いペースです。次は集中度をもう一段階上げてみましょう。"
+        if score >= 40:
+            return "お疲れ様でした。短い休憩を挟んで、次のセッションに備えましょう。"
+        return "まずは短い時間からでも大丈夫です。体調を整えて、もう一度挑戦しましょう。"
+
+    def to_dict(self):
+        return {
+            "intercept": self.intercept,
+            "weights": dict(zip(FEATURE_NAMES, self.weights)),
+            "samples": self.samples,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        weights = [data["weights"][name] for name in FEATURE_NAMES]
+        return cls(data["intercept"], weights, data.get("samples", 0))
+
+
+def _solve(matrix, vector):
+    """Solves a small dense linear system with Gauss-Jordan elimination."""
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            raise ValueError("Singular system; not enough varied samples to fit")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        pivot_value = rows[col][col]
+        rows[col] = [v / pivot_value for v in rows[col]]
+        for r in range(n):
+            if r != col and rows[r][col] != 0:
+                factor = rows[r][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][n] for i in range(n)]
+
+
+def fit(samples, ridge=1.0):
+    """
+    Fits a HeuristicScorer with ridge-regularized least squares.
+    `samples` is an iterable of (features, score) pairs.
+    """
+    size = len(FEATURE_NAMES) + 1
+    xtx = [[0.0] * size for _ in range(size)]
+    xty = [0.0] * size
+    count = 0
+    for features, score in samples:
+        x = (1.0,) + tuple(features)
+        for i in range(size):
+            xty[i] += x[i] * score
+            for j in range(size):
+                xtx[i][j] += x[i] * x[j]
+        count += 1
+
+    if count < size:
+        raise ValueError(f"Need at least {size} samples to fit, got {count}")
+
+    # Do not penalize the intercept
+    for i in range(1, size):
+        xtx[i][i] += ridge
+
+    coefficients = _solve(xtx, xty)
+    return HeuristicScorer(coefficients[0], coefficients[1:], samples=count)
+
+
+def save_scorer(scorer, path=DEFAULT_MODEL_PATH):
+    # Written aside and renamed, so workers never read a half-written model
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(scorer.to_dict(), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_scorer(path=DEFAULT_MODEL_PATH):
+    """
+    Loads a fitted model, falling back to the default weights. Cached per
+    file modification time, so a refitted model is picked up without a restart.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return HeuristicScorer()
+    return _load_scorer(path, mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _load_scorer(path, mtime_ns):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return HeuristicScorer.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Failed to load scoring model from {path}: {e}")
+        return HeuristicScorer()
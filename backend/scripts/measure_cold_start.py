@@ -0,0 +1,68 @@
+"""
+Measures the cold-start time of a web worker: importing the app module,
+building the app with create_app(), and serving the first request.
+
+    python scripts/measure_cold_start.py --runs 5 --budget-ms 800
+
+Each run uses a fresh interpreter. Exits with status 1 if the median total
+exceeds the budget, so it can be used as a CI/deploy check.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the fresh interpreter and prints the timings as JSON
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+flask_app = app_module.create_app()
+created = time.perf_counter()
+response = flask_app.test_client().get('/api/health')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "total_ms": (served - start) * 1000,
+}))
+"""
+
+
+def run_once():
+    env = dict(os.environ)
+    # Building the app must not need a reachable database
+    env.setdefault("DATABASE_URL", "sqlite://")
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("COLD_START_BUDGET_MS", 800)))
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    for key in ("import_ms", "create_app_ms", "first_request_ms", "total_ms"):
+        values = [run[key] for run in runs]
+        print(f"{key:>18}: median {statistics.median(values):8.1f}  max {max(values):8.1f}")
+
+    median_total = statistics.median(run["total_ms"] for run in runs)
+    if median_total > args.budget_ms:
+        print(f"Cold start {median_total:.1f}ms exceeds the budget of {args.budget_ms:.0f}ms")
+        return 1
+    print(f"Cold start {median_total:.1f}ms is within the budget of {args.budget_ms:.0f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
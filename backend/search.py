@@ -0,0 +1,110 @@
+"""
+N-gram full-text search over the text fields of ActivityLog.data.
+
+Japanese has no spaces between words, so text is indexed as character
+bigrams and single characters (NFKC-normalized, case-folded, split at
+spaces and punctuation) in activity_log_ngrams. A query matches a log when
+all of its bigrams occur in the log. Results are ranked by the summed field
+weights of the matched grams, so hits in the task title rank above hits in
+AI comments.
+"""
+import re
+import unicodedata
+
+from models import ActivityLog, ActivityLogNgram, db
+from sqlalchemy import case, delete, event, func, inspect, insert, select
+from sqlalchemy.orm import Session
+
+# Indexed fields of ActivityLog.data and their ranking weights
+SEARCH_FIELDS = {'task_content': 3, 'ai_feedback': 1, 'ai_advice': 1}
+FIELD_IDS = {name: i for i, name in enumerate(SEARCH_FIELDS)}
+FIELD_WEIGHTS = [SEARCH_FIELDS[name] for name in SEARCH_FIELDS]
+MAX_QUERY_CHARS = 100
+
+_SEPARATORS = re.compile(r"[\s\W_]+")
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def _segments(text):
+    return [segment for segment in _SEPARATORS.split(normalize(text)) if segment]
+
+
+def query_grams(text):
+    """Distinct bigrams of each segment of the query (a 1-character segment is its own gram)."""
+    grams = set()
+    for segment in _segments(text):
+        if len(segment) == 1:
+            grams.add(segment)
+        grams.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+
+def index_grams(text):
+    """Every bigram and character of the text, so both long and 1-character queries are lookups."""
+    grams = set()
+    for segment in _segments(text):
+        grams.update(segment)
+        grams.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+
+def index_rows(log):
+    rows = []
+    for name, field_id in FIELD_IDS.items():
+        value = (log.data or {}).get(name)
+        if isinstance(value, str):
+            rows.extend({'user_id': log.user_id, 'log_id': log.id, 'field': field_id, 'gram': gram}
+                        for gram in index_grams(value))
+    return rows
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_search_index(session, flush_context):
+    connection = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, ActivityLog):
+            continue
+        is_new = obj in session.new
+        if not is_new and obj not in session.deleted and not inspect(obj).attrs.data.history.has_changes():
+            continue
+        connection = connection or session.connection()
+        if not is_new:
+            connection.execute(delete(ActivityLogNgram).where(ActivityLogNgram.log_id == obj.id))
+        if obj not in session.deleted:
+            rows = index_rows(obj)
+            if rows:
+                connection.execute(insert(ActivityLogNgram), rows)
+
+
+def search_logs(user_id, query, limit=20, offset=0):
+    """
+    Returns (total, [(ActivityLog, rank)]) for the user's logs containing
+    every bigram of the query, best matches first, then newest first.
+    """
+    grams = query_grams(query)
+    if not grams:
+        return 0, []
+
+    weight = func.sum(case(
+        *[(ActivityLogNgram.field == field_id, w) for field_id, w in enumerate(FIELD_WEIGHTS)], else_=1))
+    matches = select(
+        ActivityLogNgram.log_id, weight.label('rank')
+    ).where(
+        ActivityLogNgram.user_id == user_id, ActivityLogNgram.gram.in_(grams)
+    ).group_by(ActivityLogNgram.log_id).having(
+        func.count(func.distinct(ActivityLogNgram.gram)) == len(grams)
+    ).subquery()
+
+    total = db.session.scalar(select(func.count()).select_from(matches))
+    if not total:
+        return 0, []
+    rows = db.session.execute(
+        select(ActivityLog, matches.c.rank)
+        .join(matches, matches.c.log_id == ActivityLog.id)
+        .order_by(matches.c.rank.desc(), ActivityLog.created_at.desc(), ActivityLog.id.desc())
+        .limit(limit).offset(offset)
+    ).all()
+    return total, [(log, int(rank)) for log, rank in rows]
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import threading
+from functools import wraps
+
+from flask import current_app, request
+from flask_login import current_user
+from models import db
+from sqlalchemy import text
+
+
+class _Call:
+    """An in-flight computation that concurrent identical requests wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None  # (body, status, headers) of the leader's response
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+_stats = {"leaders": 0, "coalesced": 0}
+
+
+def _request_key(name):
+    args = "&".join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    return f"{name}:{current_user.id}:{args}"
+
+
+def advisory_lock_id(key):
+    """Maps a key to the signed 64-bit id Postgres advisory locks take."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+def _acquire_advisory_lock(key):
+    """
+    Takes a transaction-scoped advisory lock, so identical requests in other
+    workers wait until this one commits (and can then reuse what it stored).
+    Only on Postgres; elsewhere the in-process coalescing is all we get.
+    """
+    if not current_app.config["SINGLE_FLIGHT_ADVISORY_LOCKS"] or db.engine.dialect.name != "postgresql":
+        return
+    timeout_ms = int(current_app.config["SINGLE_FLIGHT_TIMEOUT_SECONDS"] * 1000)
+    try:
+        db.session.execute(text(f"SET LOCAL lock_timeout = {timeout_ms}"))
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": advisory_lock_id(key)})
+    except Exception as e:
+        # Waiting too long is worse than computing twice
+        db.session.rollback()
+        logging.warning(f"Advisory lock for '{key}' not acquired: {e}")
+
+
+def single_flight(name, cross_worker=False):
+    """
+    Coalesces concurrent identical GET requests (same user, endpoint and query
+    string): the first one runs the view, the others wait for and reuse its
+    response. With cross_worker=True the leader also holds a Postgres advisory
+    lock, for views whose result is persisted (e.g. stored AI feedback).
+    Must be applied below @login_required.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+
+            key = _request_key(name)
+            with _calls_lock:
+                call = _calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _calls[key] = _Call()
+                    _stats["leaders"] += 1
+                else:
+                    _stats["coalesced"] += 1
+
+            if not leader:
+                if call.done.wait(current_app.config["SINGLE_FLIGHT_TIMEOUT_SECONDS"]) and call.response:
+                    body, status, headers = call.response
+                    return current_app.response_class(body, status=status, headers=headers)
+                # The leader failed or is stuck; compute independently
+                return view(*args, **kwargs)
+
+            try:
+                if cross_worker:
+                    _acquire_advisory_lock(key)
+                response = current_app.make_response(view(*args, **kwargs))
+                # Errors are not shared; waiters then retry on their own
+                if not response.is_streamed and response.status_code < 400:
+                    call.response = (response.get_data(), response.status_code, list(response.headers))
+                return response
+            finally:
+                with _calls_lock:
+                    _calls.pop(key, None)
+                call.done.set()
+        return wrapper
+    return decorator
+
+
+def single_flight_stats():
+    """Returns how many requests ran their view and how many reused another's response."""
+    with _calls_lock:
+        return dict(_stats)
@@ -0,0 +1,48 @@
+"""
+Fixtures: an app on an in-memory SQLite database with one logged-in user.
+Run with `python -m pytest` from backend/.
+"""
+import datetime
+
+import pytest
+from app import create_app
+from models import ActivityLog, User, db
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "SESSION_COOKIE_SECURE": False,
+        "PROMPT_CACHE_TTL_SECONDS": 0,
+        "EVENTS_BACKEND": "local",
+        "TESTING": True,
+    })
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(google_id="g1", email="user1@example.com", name="User 1"))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "1"
+        session["_fresh"] = True
+    return client
+
+
+@pytest.fixture
+def add_log(app):
+    """Adds and commits an ActivityLog; `days_ago` shifts created_at back."""
+    def add(user_id=1, log_type='focus', days_ago=0, **data):
+        log = ActivityLog(user_id=user_id, log_type=log_type, data=data,
+                          created_at=datetime.datetime.utcnow() - datetime.timedelta(days=days_ago))
+        db.session.add(log)
+        db.session.commit()
+        return log
+    return add
@@ -0,0 +1,50 @@
+import app as backend
+import pytest
+from admission import AdmissionPool, Overloaded
+from models import ActivityLog, db
+
+
+@pytest.fixture
+def full_ai_pool(app):
+    """Replaces the 'ai' pool with one that has no slots and no queue."""
+    app.extensions["admission"]["ai"] = AdmissionPool("ai", concurrency=0, queue_size=0, queue_timeout=0)
+
+
+def test_pool_sheds_beyond_its_queue():
+    pool = AdmissionPool("test", concurrency=1, queue_size=0, queue_timeout=1)
+    pool.acquire()
+    with pytest.raises(Overloaded) as shed:
+        pool.acquire()
+    assert shed.value.reason == "queue full" and shed.value.retry_after >= 1
+    pool.release(0.5)
+    pool.acquire()
+    assert pool.stats()["shed_queue_full"] == 1
+
+
+def test_over_budget_pool_returns_503_with_retry_after(client, full_ai_pool):
+    response = client.post("/api/lounge/quick", json={"sleep_hours": 7, "screen_time": 60, "mood": 3})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert ActivityLog.query.count() == 0
+
+
+def test_preflight_is_not_shed(client, full_ai_pool):
+    assert client.options("/api/chat/focus").status_code == 200
+
+
+def test_db_writes_are_not_shed_by_the_ai_pool(app, client, full_ai_pool, monkeypatch):
+    refinements = []
+    monkeypatch.setattr(backend.scoring_executor, "submit", lambda *args: refinements.append(args))
+    app.config["SCORING_MODE"] = "llm"
+
+    response = client.post("/api/activity/log", json={
+        "log_type": "life", "data": {"sleep_hours": 7, "screen_time": 60, "mood": 3}})
+    assert response.status_code == 201
+
+    # No AI slot: the local model scores now and the AI refines it afterwards
+    response = client.post("/api/activity/log", json={
+        "log_type": "focus", "data": {"task_content": "資料作成", "duration_minutes": 60}})
+    assert response.status_code == 201
+    log = db.session.get(ActivityLog, response.get_json()["log_id"])
+    assert log.data["score_source"] == "heuristic"
+    assert len(refinements) == 1
@@ -0,0 +1,45 @@
+import datetime
+
+import pytest
+from deletion import parse_bulk_delete_filters
+from models import (ActivityLog, AnalyticsLogChange, User, WeeklyFeedback,
+                    db)
+
+
+def test_filters_are_validated():
+    assert parse_bulk_delete_filters({"ids": [1, 2]}) == {'ids': [1, 2]}
+    # Aware datetimes are converted to the naive UTC of created_at
+    assert parse_bulk_delete_filters({"start": "2025-01-06T00:00:00+09:00"}) == {
+        'start': datetime.datetime(2025, 1, 5, 15, 0)}
+    for body in ({}, {"ids": "1"}, {"ids": [True]}, {"start": "yesterday"}, {"log_type": "sleep"}, []):
+        with pytest.raises(ValueError):
+            parse_bulk_delete_filters(body)
+
+
+def test_bulk_delete_by_ids_touches_only_own_logs(client, add_log):
+    db.session.add(User(google_id="g2", email="user2@example.com", name="User 2"))
+    db.session.add(WeeklyFeedback(user_id=1, feedback="...", last_log_id=1))
+    db.session.commit()
+    mine = [add_log(task_content=f"task {i}", duration_minutes=25, score=50).id for i in range(3)]
+    theirs = add_log(user_id=2, task_content="other", duration_minutes=25, score=50).id
+    db.session.query(AnalyticsLogChange).delete()
+    db.session.commit()
+
+    response = client.post("/api/history/delete", json={"ids": mine[:2] + [theirs]})
+    assert response.get_json() == {'deleted': 2}
+    assert {log.id for log in ActivityLog.query} == {mine[2], theirs}
+    # The stored feedback may quote deleted logs
+    assert WeeklyFeedback.query.count() == 0
+    # One queued rollup removal per deleted log
+    assert sorted((c.log_id, c.sign) for c in AnalyticsLogChange.query) == [(mine[0], -1), (mine[1], -1)]
+
+
+def test_bulk_delete_by_range_and_type(client, add_log):
+    add_log(days_ago=10, task_content="old", duration_minutes=25, score=50)
+    old_life = add_log(days_ago=10, log_type='life', sleep_hours=7, screen_time=60, mood=3).id
+    recent = add_log(days_ago=1, task_content="recent", duration_minutes=25, score=50).id
+    end = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=5)).isoformat()
+
+    response = client.post("/api/history/delete", json={"end": end, "log_type": "focus"})
+    assert response.get_json() == {'deleted': 1}
+    assert {log.id for log in ActivityLog.query} == {old_life, recent}
@@ -0,0 +1,67 @@
+import numpy as np
+from app import similar_sessions_context
+from embeddings import UserIndex, _user_index, find_similar_sessions, get_embedder
+from models import ActivityLogEmbedding, db
+from sqlalchemy import delete
+
+
+def store_vector(log, text):
+    embedder = get_embedder()
+    db.session.add(ActivityLogEmbedding(log_id=log.id, user_id=log.user_id, model=embedder.name,
+                                        vector=embedder.embed(text).astype(np.float32).tobytes()))
+    db.session.commit()
+
+
+def test_index_picks_up_backfilled_vectors_and_drops_deleted_ones(add_log):
+    old = add_log(days_ago=3, task_content="英語の単語を暗記")
+    newer = add_log(task_content="英語の長文読解")
+    store_vector(newer, newer.data['task_content'])
+    model = get_embedder().name
+    assert _user_index(1, model).log_ids == {newer.id}
+
+    # Backfilled for an older log after the index was built
+    store_vector(old, old.data['task_content'])
+    assert _user_index(1, model).log_ids == {old.id, newer.id}
+
+    # Deleted elsewhere (another worker), without evicting this worker's index
+    db.session.execute(delete(ActivityLogEmbedding).where(ActivityLogEmbedding.log_id == newer.id))
+    db.session.commit()
+    index = _user_index(1, model)
+    assert index.log_ids == {old.id} and index.size == 1
+
+    matches = find_similar_sessions(1, get_embedder().embed("英語の単語"), k=3)
+    assert [log.id for log, _ in matches] == [old.id]
+
+
+def test_unchanged_vectors_skip_the_id_diff(add_log, monkeypatch):
+    log = add_log(task_content="英語の単語を暗記")
+    store_vector(log, log.data['task_content'])
+    model = get_embedder().name
+    index = _user_index(1, model)
+
+    def fail(self, *args):
+        raise AssertionError("index resynced")
+    monkeypatch.setattr(UserIndex, "remove", fail)
+    monkeypatch.setattr(UserIndex, "extend", fail)
+    assert _user_index(1, model) is index
+
+
+def test_saved_logs_reuse_their_stored_vector(add_log, monkeypatch):
+    similar = add_log(days_ago=3, task_content="英語の単語を暗記", duration_minutes=30, score=70)
+    latest = add_log(task_content="英語の単語テスト", duration_minutes=20, score=80)
+    unsaved = add_log(task_content="英語の単語を復習", duration_minutes=20, score=60)
+    for log in (similar, latest):
+        store_vector(log, log.data['task_content'])
+
+    embedder = get_embedder()
+    calls = []
+    embed = embedder.embed
+    monkeypatch.setattr(embedder, "embed", lambda text: calls.append(text) or embed(text))
+
+    vector, context = similar_sessions_context(1, latest.data['task_content'], log_id=latest.id)
+    assert calls == [] and "英語の単語を暗記" in context and "英語の単語テスト" not in context
+    assert np.allclose(vector, embed(latest.data['task_content']))
+
+    # A log without a stored vector is embedded
+    similar_sessions_context(1, unsaved.data['task_content'], log_id=unsaved.id)
+    assert calls == [unsaved.data['task_content']]
@@ -0,0 +1,38 @@
+import json
+
+from events import bus
+from models import db
+
+
+def test_events_carry_ids_not_log_text(app, client, add_log):
+    subscription = bus.subscribe(1, max_streams=10)
+    try:
+        log = add_log(task_content="x" * 20000, duration_minutes=30, score=40)
+        log.data = {**log.data, 'score': 80}
+        db.session.commit()
+        events = subscription.get(timeout=0)
+    finally:
+        bus.unsubscribe(subscription)
+
+    assert events == [
+        {'type': 'created', 'log_id': log.id, 'log_type': 'focus'},
+        {'type': 'scored', 'log_id': log.id, 'score': 80},
+    ]
+    # Far below the 8000-byte NOTIFY limit whatever the log contains
+    assert all(len(json.dumps({'user_id': 1, 'event': event})) < 200 for event in events)
+
+    fetched = client.get(f"/api/history/{log.id}").get_json()
+    assert fetched['data']['score'] == 80 and len(fetched['data']['task_content']) == 20000
+    assert client.get("/api/history/999").status_code == 404
+
+
+def test_stream_over_the_cap_asks_the_client_to_retry(app, client):
+    app.config["EVENTS_MAX_STREAMS"] = 1
+    held = bus.subscribe(2, max_streams=1)
+    try:
+        response = client.get("/api/events")
+    finally:
+        bus.unsubscribe(held)
+    # EventSource only reconnects after a 200 stream ends
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).startswith("retry: ")
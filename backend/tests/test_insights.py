@@ -0,0 +1,68 @@
+import datetime
+
+import numpy as np
+import pytest
+from insights import (best_hours, build_focus_series, build_life_series,
+                      compute_insights, correlation, format_insights_for_prompt,
+                      rolling_mean)
+
+START = datetime.date(2025, 1, 1)
+
+
+def at(day, hour=9):
+    return datetime.datetime(2025, 1, 1 + day, hour)
+
+
+def test_rolling_mean_skips_missing_days():
+    values = np.array([1.0, np.nan, 3.0, 5.0])
+    assert rolling_mean(values, 2).tolist() == [1.0, 1.0, 3.0, 4.0]
+
+
+def test_correlation_needs_enough_varied_days():
+    assert correlation(np.array([1.0, 2.0, 3.0]), np.array([2.0, 4.0, 6.0])) == pytest.approx(1.0)
+    assert correlation(np.array([1.0, 2.0, np.nan]), np.array([2.0, 4.0, 6.0])) is None
+    assert correlation(np.array([1.0, 1.0, 1.0]), np.array([2.0, 4.0, 6.0])) is None
+
+
+def test_best_hours_ranks_hours_with_enough_sessions():
+    created_at = np.array([at(0, 9), at(1, 9), at(0, 14), at(1, 14), at(2, 20)], dtype="datetime64[s]")
+    scores = np.array([90.0, 70.0, 60.0, 50.0, 100.0])
+    # 20h has a single session, so it is not ranked
+    assert best_hours(created_at, scores) == [
+        {"hour": 9, "avg_score": 80.0, "sessions": 2},
+        {"hour": 14, "avg_score": 55.0, "sessions": 2},
+    ]
+
+
+def test_compute_insights_daily_series():
+    focus = build_focus_series([
+        (at(0), 60, 30), (at(0, 15), 80, 50), (at(1), 40, 20), (at(2), None, 10),
+        (at(9), 100, 60),  # Outside the range
+    ])
+    life = build_life_series([
+        (at(0, 7), 6.0, 120, 2), (at(0, 22), 8.0, 60, 4),  # The latest of the day wins
+        (at(2, 7), 7.0, "bad", 3),
+    ])
+    insights = compute_insights(focus, life, START, START + datetime.timedelta(days=2), window=2)
+
+    assert insights["focus_sessions"] == 4 and insights["life_logs"] == 3
+    daily = insights["daily"]
+    assert daily["date"] == ["2025-01-01", "2025-01-02", "2025-01-03"]
+    assert daily["score"] == [70.0, 40.0, None]
+    assert daily["total_duration"] == [80, 20, 10]
+    assert daily["sessions"] == [2, 1, 1]
+    assert daily["sleep_hours"] == [8.0, None, 7.0]
+    assert daily["screen_time"] == [60, None, None]
+    assert daily["rolling_score"] == [70.0, 55.0, 40.0]
+    assert insights["summary"]["avg_score"] == 60.0
+    assert insights["summary"]["avg_daily_focus_minutes"] == pytest.approx(36.7)
+    # Only two days have both sleep and score
+    assert insights["correlations"]["sleep_vs_score"] is None
+    assert "2025-01-01 〜 2025-01-03" in format_insights_for_prompt(insights)
+
+
+def test_compute_insights_without_logs():
+    insights = compute_insights(build_focus_series([]), build_life_series([]), START, START)
+    assert insights["summary"]["avg_score"] is None
+    assert insights["best_hours"] == []
+    assert insights["daily"]["sessions"] == [0]
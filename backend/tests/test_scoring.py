@@ -0,0 +1,73 @@
+import os
+
+import pytest
+from models import ActivityLog
+from scoring import (DEFAULT_WEIGHTS, HeuristicScorer, extract_features, fit,
+                     load_scorer, save_scorer)
+
+
+def test_default_weights_give_known_scores():
+    scorer = HeuristicScorer()
+    # 30 + 20 * 1h + 7 * 4 - 3 * 0 + 2 * 3
+    assert scorer.score(60, focus_level=4, sleep_hours=7.5, mood=3) == 84
+    # Missing inputs use the defaults (focus 3, sleep 7.0, mood 3): 75.5
+    assert scorer.score(60) == 76
+    # Minutes are capped and the score is clamped to 0-100
+    assert scorer.score(600, focus_level=5, sleep_hours=7.5, mood=5) == 100
+    assert HeuristicScorer(intercept=-50).score(0) == 0
+
+
+def test_fit_recovers_the_generating_weights():
+    intercept, weights = 12.0, (15.0, 5.0, -4.0, 3.0)
+    samples = []
+    for minutes in (15, 30, 60, 90):
+        for focus_level in (1, 3, 5):
+            for sleep_hours in (5, 7.5, 9):
+                for mood in (2, 4):
+                    features = extract_features(minutes, focus_level, sleep_hours, mood)
+                    samples.append((features, intercept + sum(w * x for w, x in zip(weights, features))))
+
+    scorer = fit(iter(samples), ridge=0.0)
+    assert scorer.samples == len(samples)
+    assert scorer.intercept == pytest.approx(intercept)
+    assert scorer.weights == pytest.approx(weights)
+
+
+def test_fit_rejects_too_few_samples():
+    with pytest.raises(ValueError):
+        fit([(extract_features(30), 50)] * 3)
+
+
+def test_missing_model_file_falls_back_to_default_weights(tmp_path):
+    assert load_scorer(str(tmp_path / "missing.json")).weights == DEFAULT_WEIGHTS
+
+
+def test_refitted_model_is_reloaded(tmp_path):
+    path = str(tmp_path / "model.json")
+    save_scorer(HeuristicScorer(intercept=10, samples=5), path)
+    assert load_scorer(path).intercept == 10
+    save_scorer(HeuristicScorer(intercept=20, samples=6), path)
+    os.utime(path, ns=(1, 1))  # Same-second rewrites must still change the cache key
+    assert load_scorer(path).intercept == 20
+
+
+def test_heuristic_mode_scores_without_a_model_file(app, client, tmp_path):
+    app.config.update(SCORING_MODE='heuristic', SCORING_MODEL_PATH=str(tmp_path / "missing.json"))
+    response = client.post("/api/focus/quick", json={"task_content": "資料作成", "duration_minutes": 60})
+    assert response.get_json()['score'] == 76
+    assert ActivityLog.query.one().data['score_source'] == 'heuristic'
+
+
+def test_fit_command_learns_only_from_ai_scores(app, add_log, tmp_path):
+    path = tmp_path / "model.json"
+    app.config["SCORING_MODEL_PATH"] = str(path)
+    add_log(log_type='life', days_ago=1, sleep_hours=6, screen_time=60, mood=4)
+    for i in range(8):
+        add_log(task_content=f"task {i}", duration_minutes=15 * (i + 1), focus_level=1 + i % 5,
+                score=20 + 8 * i, score_source='llm')
+    # The model's own scores are never training data
+    add_log(task_content="heuristic", duration_minutes=30, score=99, score_source='heuristic')
+
+    result = app.test_cli_runner().invoke(args=["fit-scoring-model"])
+    assert "Fitted scoring model on 8 logs" in result.output
+    assert load_scorer(str(path)).samples == 8
@@ -0,0 +1,53 @@
+from models import ActivityLog, User, db
+from search import query_grams, search_logs
+
+
+def ids(matches):
+    return [log.id for log, _ in matches[1]]
+
+
+def test_query_grams_normalize_width_and_case():
+    assert query_grams("ＡＰＩ 設計") == {"ap", "pi", "設計"}
+    assert query_grams("英") == {"英"}
+    assert query_grams(" 、。") == set()
+
+
+def test_every_query_bigram_must_match(add_log):
+    english = add_log(task_content="英語の単語を暗記")
+    add_log(task_content="英会話レッスン")
+    assert ids(search_logs(1, "英語")) == [english.id]
+    assert ids(search_logs(1, "英語 暗記")) == [english.id]
+    assert search_logs(1, "英語 数学") == (0, [])
+
+
+def test_single_character_query_matches_any_position(add_log):
+    first = add_log(task_content="数学の問題")
+    second = add_log(task_content="統計学")
+    assert sorted(ids(search_logs(1, "学"))) == sorted([first.id, second.id])
+
+
+def test_title_hits_rank_above_ai_comments(add_log):
+    comment_hit = add_log(task_content="資料作成", ai_feedback="次は英語も")
+    title_hit = add_log(task_content="英語リスニング", ai_feedback="良い集中")
+    total, matches = search_logs(1, "英語")
+    assert total == 2
+    assert [log.id for log, _ in matches] == [title_hit.id, comment_hit.id]
+
+
+def test_index_follows_edits_and_deletes(add_log, client):
+    log = add_log(task_content="英語")
+    log.data = {**log.data, 'task_content': "数学"}
+    db.session.commit()
+    assert search_logs(1, "英語") == (0, [])
+    assert ids(search_logs(1, "数学")) == [log.id]
+
+    assert client.delete(f"/api/history/{log.id}").status_code == 200
+    assert search_logs(1, "数学") == (0, [])
+
+
+def test_other_users_logs_are_not_matched(add_log):
+    db.session.add(User(google_id="g2", email="user2@example.com", name="User 2"))
+    db.session.commit()
+    add_log(user_id=2, task_content="英語")
+    assert search_logs(1, "英語") == (0, [])
+    assert ActivityLog.query.count() == 1
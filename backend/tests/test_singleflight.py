@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+import pytest
+from flask import jsonify
+from flask_login import login_required
+from models import db
+from singleflight import _acquire_advisory_lock, single_flight
+
+
+@pytest.fixture
+def slow_view(app):
+    """A coalesced GET view that blocks until `release` is set."""
+    state = {'calls': 0, 'status': 200, 'release': threading.Event(), 'entered': threading.Event()}
+
+    @login_required
+    @single_flight('test')
+    def view():
+        state['calls'] += 1
+        state['entered'].set()
+        state['release'].wait(5)
+        return jsonify({'calls': state['calls']}), state['status']
+
+    app.add_url_rule('/test/slow', 'slow', view)
+    return state
+
+
+def concurrent_gets(app, client, count, path='/test/slow'):
+    cookie = client.get_cookie('session')
+    results = [None] * count
+
+    def get(i):
+        other = app.test_client()
+        other.set_cookie('session', cookie.value)
+        response = other.get(path)
+        results[i] = (response.status_code, response.get_json())
+
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(count)]
+    return threads, results
+
+
+def run(threads, state):
+    threads[0].start()
+    assert state['entered'].wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # Let the followers reach the wait before the leader finishes
+    time.sleep(0.2)
+    state['release'].set()
+    for thread in threads:
+        thread.join(5)
+
+
+def test_concurrent_identical_gets_run_the_view_once(app, client, slow_view):
+    threads, results = concurrent_gets(app, client, 4)
+    run(threads, slow_view)
+    assert slow_view['calls'] == 1
+    assert results == [(200, {'calls': 1})] * 4
+
+
+def test_errors_are_not_shared(app, client, slow_view):
+    slow_view['status'] = 500
+    threads, results = concurrent_gets(app, client, 3)
+    run(threads, slow_view)
+    # Each follower retried on its own
+    assert slow_view['calls'] == 3
+    assert all(status == 500 for status, _ in results)
+
+
+def test_advisory_lock_failure_falls_back_to_computing(app, monkeypatch, caplog):
+    # Pretend to be Postgres: the lock statements then fail on SQLite
+    monkeypatch.setattr(db.engine.dialect, 'name', 'postgresql')
+    with app.test_request_context(), caplog.at_level(logging.WARNING):
+        _acquire_advisory_lock('feedback:1:')
+    assert "not acquired" in caplog.text
@@ -0,0 +1,63 @@
+import datetime
+
+import pytest
+import usage
+from models import AiCallLog, AiUsageDaily, db
+from sqlalchemy import text
+from usage import UsageBuffer
+
+
+def call(user_id, tokens=10):
+    return {'created_at': datetime.datetime.utcnow(), 'user_id': user_id, 'feature': 'focus_scoring',
+            'model': 'gemini', 'input_tokens': tokens, 'cached_tokens': 0, 'output_tokens': tokens,
+            'latency_ms': 100, 'outcome': 'ok'}
+
+
+@pytest.fixture
+def foreign_keys(app):
+    # As on Postgres, calls of a missing user violate the users foreign key
+    db.session.execute(text("PRAGMA foreign_keys=ON"))
+    db.session.commit()
+
+
+def test_flush_writes_calls_and_daily_totals(app):
+    buffer = UsageBuffer()
+    buffer._calls = [call(1), call(1, tokens=5), call(None)]
+    buffer.flush(app)
+    assert AiCallLog.query.count() == 3
+    daily = AiUsageDaily.query.one()
+    assert (daily.user_id, daily.calls, daily.input_tokens) == (1, 2, 15)
+    assert buffer.stats() == {"pending": 0, "flushed": 3, "dropped": 0}
+
+
+def test_calls_of_a_deleted_user_do_not_block_the_rest(app, foreign_keys):
+    buffer = UsageBuffer()
+    buffer._calls = [call(1), call(99), call(None), call(99)]
+    buffer.flush(app)
+    assert sorted(row.user_id or 0 for row in AiCallLog.query) == [0, 1]
+    assert buffer.stats() == {"pending": 0, "flushed": 2, "dropped": 2}
+
+
+def test_calls_are_kept_while_the_database_is_down(app, monkeypatch):
+    def fail(connection, calls):
+        raise RuntimeError("database is down")
+    monkeypatch.setattr(usage, 'write_calls', fail)
+    app.config["AI_USAGE_BUFFER_MAX"] = 3
+    buffer = UsageBuffer()
+    buffer._calls = [call(1), call(1), call(None), call(1)]
+    buffer.flush(app)
+    # Requeued up to the bound, oldest dropped first
+    assert buffer.stats() == {"pending": 3, "flushed": 0, "dropped": 1}
+
+    monkeypatch.undo()
+    buffer.flush(app)
+    assert buffer.stats() == {"pending": 0, "flushed": 3, "dropped": 1}
+
+
+def test_purge_discards_the_users_buffered_calls(app, client, monkeypatch):
+    buffer = UsageBuffer()
+    monkeypatch.setattr(usage, 'buffer', buffer)
+    monkeypatch.setattr('deletion.usage_buffer', buffer)
+    buffer._calls = [call(1), call(None)]
+    assert client.delete("/api/me").status_code == 200
+    assert [c['user_id'] for c in buffer._calls] == [None]
@@ -0,0 +1,216 @@
+"""
+OpenTelemetry tracing of requests, SQL statements, commits and AI calls.
+
+Optional: needs the packages of requirements-tracing.txt (opentelemetry-sdk,
+plus the OTLP exporter for 'otlp'), which the Docker image installs unless
+built with INSTALL_TRACING=false. Without them, or with TRACING_EXPORTER
+unset, every helper here is a no-op.
+
+Exporters (TRACING_EXPORTER):
+  - console: spans printed to stdout, for local debugging.
+  - file: one JSON span per line in TRACING_FILE, for tests and offline analysis.
+  - otlp: OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (a collector, Jaeger, ...).
+
+A TRACING_SAMPLE_RATIO share of requests is traced (or whatever an incoming
+W3C traceparent decided). SQL and commit spans are only created inside a
+sampled span, so unsampled requests pay for one non-recording span.
+"""
+import hashlib
+import hmac
+import json
+import logging
+from contextlib import contextmanager
+
+from flask import g, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+try:
+    from opentelemetry import context as otel_context
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (BatchSpanProcessor,
+                                                ConsoleSpanExporter,
+                                                SpanExporter,
+                                                SpanExportResult)
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+except ImportError:
+    trace = None
+
+# Longer statements are truncated in the db.statement attribute
+MAX_STATEMENT_CHARS = 1000
+
+_tracer = None
+_user_hash_key = b''
+
+
+if trace is not None:
+    class JsonLinesSpanExporter(SpanExporter):
+        """Appends each finished span to a file as one line of JSON."""
+
+        def __init__(self, path):
+            self.path = path
+
+        def export(self, spans):
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    for span in spans:
+                        f.write(json.dumps(json.loads(span.to_json()), ensure_ascii=False) + '\n')
+                return SpanExportResult.SUCCESS
+            except OSError as e:
+                logging.error(f"Failed to write spans to {self.path}: {e}")
+                return SpanExportResult.FAILURE
+
+
+def _exporter(name, app):
+    if name == 'console':
+        return ConsoleSpanExporter()
+    if name == 'file':
+        return JsonLinesSpanExporter(app.config["TRACING_FILE"])
+    if name == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    raise ValueError(f"Invalid TRACING_EXPORTER '{name}', expected 'console', 'file' or 'otlp'")
+
+
+def init_tracing(app):
+    """Sets up the tracer and the request hooks from the app's TRACING_* config."""
+    global _tracer, _user_hash_key
+    exporter_name = app.config["TRACING_EXPORTER"]
+    if not exporter_name:
+        return
+    if trace is None:
+        logging.warning("TRACING_EXPORTER is set but opentelemetry-sdk is not installed; tracing is disabled")
+        return
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": app.config["TRACING_SERVICE_NAME"]}),
+        sampler=ParentBased(TraceIdRatioBased(app.config["TRACING_SAMPLE_RATIO"])),
+    )
+    # Exports from a background thread (re-created after a fork)
+    provider.add_span_processor(BatchSpanProcessor(_exporter(exporter_name, app)))
+    app.extensions["tracing"] = provider  # e.g. provider.force_flush() in tests
+    _tracer = provider.get_tracer("prodigyhabit")
+    _user_hash_key = app.secret_key.encode()
+
+    app.before_request(_start_request_span)
+    app.after_request(_annotate_request_span)
+    app.teardown_request(_end_request_span)
+
+
+def user_id_hash(user_id):
+    """Identifies a user across spans without exporting the id itself."""
+    return hmac.new(_user_hash_key, str(user_id).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def _recording_parent():
+    return _tracer is not None and trace.get_current_span().is_recording()
+
+
+@contextmanager
+def span(name, attributes=None, always=False):
+    """
+    Runs the block in a child span of the current one and yields it (None
+    when tracing is off). Without a sampled parent, no span is created
+    unless `always` is set, in which case the sampler decides.
+    """
+    if _tracer is None or not (always or _recording_parent()):
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def set_attributes(current, attributes):
+    if current is not None and current.is_recording():
+        current.set_attributes({key: value for key, value in attributes.items() if value is not None})
+
+
+# --- Requests ---
+def _start_request_span():
+    route = request.url_rule.rule if request.url_rule else request.path
+    current = _tracer.start_span(
+        f"{request.method} {route}",
+        context=propagate.extract(request.headers),
+        kind=trace.SpanKind.SERVER,
+        attributes={"http.request.method": request.method, "http.route": route, "url.path": request.path},
+    )
+    g._trace_span = current
+    g._trace_token = otel_context.attach(trace.set_span_in_context(current))
+
+
+def _annotate_request_span(response):
+    current = g.get('_trace_span')
+    if current is not None and current.is_recording():
+        current.set_attribute("http.response.status_code", response.status_code)
+        if current_user.is_authenticated:
+            current.set_attribute("enduser.id_hash", user_id_hash(current_user.id))
+    return response
+
+
+def _end_request_span(error):
+    current = g.pop('_trace_span', None)
+    if current is None:
+        return
+    if error is not None:
+        current.record_exception(error)
+        current.set_status(trace.StatusCode.ERROR)
+    current.end()
+    otel_context.detach(g.pop('_trace_token'))
+
+
+# --- SQL ---
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_sql_span(conn, cursor, statement, parameters, context, executemany):
+    if context is None or not _recording_parent():
+        return
+    context._trace_span = _tracer.start_span(
+        f"sql {statement.split(None, 1)[0].upper() if statement.strip() else 'statement'}",
+        kind=trace.SpanKind.CLIENT,
+        attributes={
+            "db.system": conn.dialect.name,
+            "db.statement": statement[:MAX_STATEMENT_CHARS],
+            "db.executemany": executemany,
+        },
+    )
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_sql_span(conn, cursor, statement, parameters, context, executemany):
+    current = getattr(context, '_trace_span', None)
+    if current is not None:
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            current.set_attribute("db.rowcount", cursor.rowcount)
+        current.end()
+        context._trace_span = None
+
+
+@event.listens_for(Engine, 'handle_error')
+def _fail_sql_span(exception_context):
+    current = getattr(exception_context.execution_context, '_trace_span', None)
+    if current is not None:
+        current.record_exception(exception_context.original_exception)
+        current.set_status(trace.StatusCode.ERROR)
+        current.end()
+        exception_context.execution_context._trace_span = None
+
+
+# --- Commits (the flush's statements become children) ---
+@event.listens_for(Session, 'before_commit')
+def _start_commit_span(session):
+    if 'trace_commit' in session.info or not _recording_parent():
+        return
+    current = _tracer.start_span("db commit")
+    session.info['trace_commit'] = (current, otel_context.attach(trace.set_span_in_context(current)))
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _end_commit_span(session):
+    current, token = session.info.pop('trace_commit', (None, None))
+    if current is not None:
+        current.end()
+        otel_context.detach(token)
@@ -0,0 +1,328 @@
+"""
+Accounting of every AI model call: tokens, latency, model and outcome.
+
+Calls are recorded in memory and written in batches: a background thread
+per worker flushes the buffer every AI_USAGE_FLUSH_SECONDS, or sooner once
+AI_USAGE_FLUSH_SIZE calls are waiting. One flush inserts the raw rows into
+ai_call_logs and adds their per-(day, user, feature) totals to
+ai_usage_daily with a single upsert per key. Raw rows are pruned after
+AI_CALL_LOG_RETENTION_DAYS (`flask prune-ai-calls`); the daily totals stay.
+
+AI_DAILY_TOKEN_QUOTA caps a user's input + output tokens per UTC day. The
+check reads ai_usage_daily plus this worker's unflushed calls, so other
+workers' last few seconds of calls can be missed.
+"""
+import atexit
+import datetime
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, has_request_context, jsonify
+from flask_login import current_user
+from models import AiCallLog, AiUsageDaily, User, db
+from sqlalchemy import func, insert, select, update
+from tracing import set_attributes, span, user_id_hash
+
+# Columns of ai_usage_daily that a flush adds to
+TOTAL_COLUMNS = ('calls', 'errors', 'input_tokens', 'cached_tokens', 'output_tokens', 'latency_ms')
+
+
+class QuotaExceeded(Exception):
+    """Raised when a user has used up their daily tokens; rendered as 429 + Retry-After."""
+
+    def __init__(self, used, quota, retry_after):
+        super().__init__(f"daily AI token quota exceeded ({used}/{quota})")
+        self.used = used
+        self.quota = quota
+        self.retry_after = retry_after
+
+
+class UsageBuffer:
+    """Calls recorded by this worker and not yet written."""
+
+    def __init__(self):
+        self._calls = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.flushed = 0
+        self.dropped = 0
+
+    def add(self, call, app):
+        with self._lock:
+            self._calls.append(call)
+            full = len(self._calls) >= app.config["AI_USAGE_FLUSH_SIZE"]
+            if self._thread is None:
+                # Started on first use, i.e. in each worker after the fork
+                self._thread = threading.Thread(
+                    target=self._run, args=(app,), name='ai-usage-flusher', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush, app)
+        if full:
+            self._wakeup.set()
+
+    def pending_tokens(self, user_id, day):
+        with self._lock:
+            return sum(call['input_tokens'] + call['output_tokens'] for call in self._calls
+                       if call['user_id'] == user_id and call['created_at'].date() == day)
+
+    def _run(self, app):
+        while True:
+            self._wakeup.wait(app.config["AI_USAGE_FLUSH_SECONDS"])
+            self._wakeup.clear()
+            self.flush(app)
+
+    def flush(self, app):
+        with self._lock:
+            calls, self._calls = self._calls, []
+        if not calls:
+            return
+        with app.app_context():
+            try:
+                self._write(calls)
+            except Exception as e:
+                logging.error(f"Failed to write {len(calls)} AI call records, retrying per user: {e}")
+                self._write_per_user(calls, app)
+
+    def _write(self, calls):
+        with db.engine.begin() as connection:
+            write_calls(connection, calls)
+        with self._lock:
+            self.flushed += len(calls)
+
+    def _write_per_user(self, calls, app):
+        """
+        Writes each user's calls in its own transaction, so one bad batch
+        (e.g. calls of an account deleted meanwhile, which violate the users
+        foreign key forever) cannot hold back everyone else's.
+        """
+        by_user = {}
+        for call in calls:
+            by_user.setdefault(call['user_id'], []).append(call)
+        failed = []
+        groups = list(by_user.items())
+        for i, (user_id, user_calls) in enumerate(groups):
+            try:
+                self._write(user_calls)
+                continue
+            except Exception as e:
+                error = e
+            try:
+                deleted = user_id is not None and db.session.get(User, user_id) is None
+            except Exception:
+                # The database itself is unavailable; keep the rest for the next flush
+                failed.extend(call for _, rest in groups[i:] for call in rest)
+                break
+            finally:
+                db.session.remove()
+            if deleted:
+                logging.warning(f"Dropped {len(user_calls)} AI call records of deleted user {user_id}")
+                with self._lock:
+                    self.dropped += len(user_calls)
+            else:
+                logging.error(f"Failed to write {len(user_calls)} AI call records of user {user_id}: {error}")
+                failed.extend(user_calls)
+        if failed:
+            self._requeue(failed, app)
+
+    def _requeue(self, calls, app):
+        with self._lock:
+            # Keep them for the next flush, up to a bound
+            self._calls[:0] = calls
+            overflow = len(self._calls) - app.config["AI_USAGE_BUFFER_MAX"]
+            if overflow > 0:
+                del self._calls[:overflow]
+                self.dropped += overflow
+
+    def discard_user(self, user_id):
+        """Forgets the unwritten calls of a deleted account."""
+        with self._lock:
+            self._calls = [call for call in self._calls if call['user_id'] != user_id]
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._calls), "flushed": self.flushed, "dropped": self.dropped}
+
+
+buffer = UsageBuffer()
+
+
+def daily_totals(calls):
+    """Sums calls per (date, user_id, feature); calls without a user are left out."""
+    totals = {}
+    for call in calls:
+        if call['user_id'] is None:
+            continue
+        key = (call['created_at'].date(), call['user_id'], call['feature'])
+        row = totals.setdefault(key, dict.fromkeys(TOTAL_COLUMNS, 0))
+        row['calls'] += 1
+        row['errors'] += call['outcome'] != 'ok'
+        for column in ('input_tokens', 'cached_tokens', 'output_tokens', 'latency_ms'):
+            row[column] += call[column]
+    return [{'date': date, 'user_id': user_id, 'feature': feature, **row}
+            for (date, user_id, feature), row in totals.items()]
+
+
+def _upsert_daily(connection, rows):
+    table = AiUsageDaily.__table__
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['date', 'user_id', 'feature'],
+            set_={column: table.c[column] + statement.excluded[column] for column in TOTAL_COLUMNS})
+        connection.execute(statement, rows)
+        return
+
+    for row in rows:
+        result = connection.execute(update(table).where(
+            table.c.date == row['date'], table.c.user_id == row['user_id'], table.c.feature == row['feature']
+        ).values({column: table.c[column] + row[column] for column in TOTAL_COLUMNS}))
+        if not result.rowcount:
+            connection.execute(insert(table), row)
+
+
+def write_calls(connection, calls):
+    connection.execute(insert(AiCallLog), calls)
+    rows = daily_totals(calls)
+    if rows:
+        _upsert_daily(connection, rows)
+
+
+def _default_user_id(user_id):
+    if user_id is None and has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return user_id
+
+
+def record_call(feature, model, usage_metadata, latency_seconds, outcome, user_id=None):
+    """Buffers one model call. `user_id` defaults to the logged-in user."""
+    buffer.add({
+        'created_at': datetime.datetime.utcnow(),
+        'user_id': _default_user_id(user_id),
+        'feature': feature,
+        'model': model,
+        'input_tokens': getattr(usage_metadata, "prompt_token_count", 0) or 0,
+        'cached_tokens': getattr(usage_metadata, "cached_content_token_count", 0) or 0,
+        'output_tokens': getattr(usage_metadata, "candidates_token_count", 0) or 0,
+        'latency_ms': int(latency_seconds * 1000),
+        'outcome': outcome,
+    }, current_app._get_current_object())
+
+
+@contextmanager
+def track_call(feature, model, user_id=None, prompt_chars=None):
+    """
+    Times, traces and records the model call made in the block. The block
+    may set call['usage_metadata'] to the response's usage_metadata.
+    """
+    call = {'usage_metadata': None}
+    user_id = _default_user_id(user_id)
+    attributes = {"gen_ai.system": "gemini", "gen_ai.request.model": model,
+                  "app.feature": feature, "app.prompt_chars": prompt_chars}
+    with span(f"ai {feature}", {key: value for key, value in attributes.items() if value is not None},
+              always=True) as current:
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield call
+            outcome = 'ok'
+        finally:
+            usage_metadata = call['usage_metadata']
+            set_attributes(current, {
+                "gen_ai.usage.input_tokens": getattr(usage_metadata, "prompt_token_count", None),
+                "gen_ai.usage.output_tokens": getattr(usage_metadata, "candidates_token_count", None),
+                "app.cached_tokens": getattr(usage_metadata, "cached_content_token_count", None),
+                "enduser.id_hash": None if user_id is None else user_id_hash(user_id),
+            })
+            record_call(feature, model, usage_metadata, time.perf_counter() - start, outcome, user_id)
+
+
+# --- Quota ---
+def tokens_used_today(user_id):
+    today = datetime.datetime.utcnow().date()
+    stored = db.session.scalar(
+        select(func.coalesce(func.sum(AiUsageDaily.input_tokens + AiUsageDaily.output_tokens), 0))
+        .where(AiUsageDaily.user_id == user_id, AiUsageDaily.date == today))
+    return int(stored) + buffer.pending_tokens(user_id, today)
+
+
+def quota_exceeded(user_id):
+    quota = current_app.config["AI_DAILY_TOKEN_QUOTA"]
+    return bool(quota) and tokens_used_today(user_id) >= quota
+
+
+def enforce_quota(user_id):
+    """Raises QuotaExceeded if the user has no tokens left today."""
+    quota = current_app.config["AI_DAILY_TOKEN_QUOTA"]
+    if not quota:
+        return
+    used = tokens_used_today(user_id)
+    if used >= quota:
+        now = datetime.datetime.utcnow()
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time.min)
+        raise QuotaExceeded(used, quota, int((midnight - now).total_seconds()) + 1)
+
+
+def ai_quota(view):
+    """Rejects the request with 429 if the current user has used up today's AI tokens."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Anonymous for CORS preflight requests, which login_required lets through
+        if current_user.is_authenticated:
+            enforce_quota(current_user.id)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def quota_exceeded_response(error):
+    response = jsonify({
+        'error': '本日のAI利用上限に達しました。明日またお試しください。',
+        'retry_after': error.retry_after,
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+# --- Reports ---
+def usage_report(start_date, end_date, top_users=10):
+    """Per-feature totals and the heaviest users between two dates (inclusive)."""
+    in_range = AiUsageDaily.date.between(start_date, end_date)
+    features = db.session.execute(
+        select(AiUsageDaily.feature, *[func.sum(AiUsageDaily.__table__.c[column]).label(column)
+                                       for column in TOTAL_COLUMNS])
+        .where(in_range).group_by(AiUsageDaily.feature).order_by(AiUsageDaily.feature)
+    ).all()
+    tokens = func.sum(AiUsageDaily.input_tokens + AiUsageDaily.output_tokens)
+    users = db.session.execute(
+        select(AiUsageDaily.user_id, func.sum(AiUsageDaily.calls).label('calls'), tokens.label('tokens'))
+        .where(in_range).group_by(AiUsageDaily.user_id).order_by(tokens.desc()).limit(top_users)
+    ).all()
+    return {
+        "features": {
+            row.feature: {
+                **{column: int(getattr(row, column)) for column in TOTAL_COLUMNS},
+                "avg_latency_ms": round(row.latency_ms / row.calls) if row.calls else None,
+            }
+            for row in features
+        },
+        "top_users": [{"user_id": row.user_id, "calls": int(row.calls), "tokens": int(row.tokens)}
+                      for row in users],
+        "buffer": buffer.stats(),
+    }
+
+
+def prune_call_logs(retention_days):
+    """Deletes raw call rows older than the retention window; returns how many."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+    result = db.session.execute(AiCallLog.__table__.delete().where(AiCallLog.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
@@ -2,6 +2,7 @@
 
 import { useEffect, useState, useMemo } from 'react';
 import api from '@/lib/api';
+import { fetchActivityLog, subscribeToActivityEvents } from '@/lib/events';
 import { ActivityLog } from '@/types';
 import { ChevronLeftIcon, ChevronRightIcon } from '@heroicons/react/24/solid';
 import { BrainCircuit, Sofa, Star, Heart, Monitor, Bed, Trash2 } from 'lucide-react'; // Lucide Icons
@@ -83,6 +84,7 @@ export default function HistoryPage() {
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [currentDate, setCurrentDate] = useState(new Date());
+  const [reloadKey, setReloadKey] = useState(0);
 
   useEffect(() => {
     const fetchHistory = async () => {
@@ -111,6 +113,27 @@ export default function HistoryPage() {
       }
     };
     fetchHistory();
+  }, [reloadKey]);
+
+  // Apply changes made in other tabs (or by background scoring) as they happen
+  useEffect(() => {
+    return subscribeToActivityEvents(async (event) => {
+      if (event.type === 'created' || event.type === 'scored') {
+        try {
+          const fetched = await fetchActivityLog(event.log_id);
+          if (!fetched) return;
+          setAllLogs(prevLogs => prevLogs.some(log => log.id === fetched.id)
+            ? prevLogs.map(log => log.id === fetched.id ? fetched : log)
+            : [fetched, ...prevLogs]);
+        } catch (err) {
+          console.error("Failed to fetch updated log:", err);
+        }
+      } else if (event.type === 'deleted') {
+        setAllLogs(prevLogs => prevLogs.filter(log => log.id !== event.log_id));
+      } else if (event.type === 'resync') {
+        setReloadKey(key => key + 1);
+      }
+    });
   }, []);
 
   const handleDeleteLog = async (logId: number) => {
@@ -126,6 +149,27 @@ export default function HistoryPage() {
     }
   };
 
+  const handleDeleteWeek = async () => {
+    // Exactly the logs shown for this week (created_at is naive UTC, so sending
+    // local week bounds would not match what the page displays)
+    const ids = weekData.flatMap(day => day.logs.map(log => log.id));
+    if (ids.length === 0) {
+      return;
+    }
+    if (!window.confirm('この週の記録をすべて削除してもよろしいですか？一度削除すると元に戻せません。')) {
+      return;
+    }
+    try {
+      // One request for the whole week; the server deletes in bulk
+      await api.post('/history/delete', { ids });
+      const deleted = new Set(ids);
+      setAllLogs(prevLogs => prevLogs.filter(log => !deleted.has(log.id)));
+    } catch (err) {
+      console.error("Failed to delete logs:", err);
+      alert('記録の削除に失敗しました。');
+    }
+  };
+
   const weekData = useMemo(() => {
     const startOfWeek = getWeekStart(currentDate);
     const endOfWeek = new Date(startOfWeek);
@@ -189,6 +233,14 @@ export default function HistoryPage() {
           <button onClick={() => changeWeek('next')} className="p-2 bg-gray-700 rounded-full hover:bg-gray-600 transition-colors cursor-pointer">
             <ChevronRightIcon className="h-6 w-6" />
           </button>
+          <button
+            onClick={handleDeleteWeek}
+            disabled={!weekData.some(({ logs }) => logs.length > 0)}
+            className="p-2 text-gray-500 hover:text-red-500 transition-colors cursor-pointer disabled:opacity-30 disabled:cursor-default"
+            title="この週の記録をすべて削除"
+          >
+            <Trash2 size={20} />
+          </button>
         </div>
       </div>
       
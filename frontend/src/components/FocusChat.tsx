@@ -31,6 +31,8 @@ export default function FocusChat({ initialDuration, onStartBreak, initialScore,
   const [isListening, setIsListening] = useState(false);
   const [isSessionSaved, setIsSessionSaved] = useState(false);
   const [cooldownMessage, setCooldownMessage] = useState<string | null>(null);
+  // Server-side conversation id; after the first turn only the new message is sent
+  const [conversationId, setConversationId] = useState<string | null>(null);
   
   const recognition = useRef<any>(null);
   const chatEndRef = useRef<HTMLDivElement>(null);
@@ -105,16 +107,19 @@ export default function FocusChat({ initialDuration, onStartBreak, initialScore,
     setCooldownMessage(null); // Clear any previous cooldown message
 
     try {
-      const payload = {
-        message: userMessage.text,
-        history: messages, // Send the history *before* the new user message was added
-        known_duration: initialDuration,
-      };
+      const payload = conversationId
+        ? { message: userMessage.text, conversation_id: conversationId }
+        : {
+            message: userMessage.text,
+            history: messages, // Seed the new conversation with the greeting shown so far
+            known_duration: initialDuration,
+          };
 
       const response = await api.post('/chat/focus', payload);
-      const { reply, focus_log_saved } = response.data;
+      const { reply, focus_log_saved, conversation_id } = response.data;
 
       setMessages(prev => [...prev, { sender: 'ai', text: reply }]);
+      setConversationId(conversation_id ?? null);
 
       if (focus_log_saved) {
         setIsSessionSaved(true);
@@ -125,6 +130,9 @@ export default function FocusChat({ initialDuration, onStartBreak, initialScore,
       if (error.response && error.response.status === 429 && error.response.data.cooldown) {
         setCooldownMessage(error.response.data.error);
         setMessages(prev => [...prev, { sender: 'ai', text: error.response.data.error }]);
+      } else if (error.response?.data?.conversation_expired) {
+        setConversationId(null);
+        setMessages(prev => [...prev, { sender: 'ai', text: error.response.data.error }]);
       } else {
         const errorMessage = error.response?.data?.error || "すみません、AIが応答できませんでした。";
         setMessages(prev => [...prev, { sender: 'ai', text: errorMessage }]);
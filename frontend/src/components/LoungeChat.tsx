@@ -29,6 +29,8 @@ export default function LoungeChat({ initialMessage }: LoungeChatProps) {
   const [isLoading, setIsLoading] = useState(false);
   const [isListening, setIsListening] = useState(false);
   const [cooldownMessage, setCooldownMessage] = useState<string | null>(null); // Added cooldownMessage state
+  // Server-side conversation id; after the first turn only the new message is sent
+  const [conversationId, setConversationId] = useState<string | null>(null);
 
   const recognition = useRef<any>(null);
   const chatEndRef = useRef<HTMLDivElement>(null);
@@ -91,12 +93,12 @@ export default function LoungeChat({ initialMessage }: LoungeChatProps) {
     setCooldownMessage(null); // Clear any previous cooldown message
 
     try {
-      const payload: { message: string; history: Message[] } = {
-        message: userMessage.text,
-        history: messages,
-      };
+      const payload: { message: string; history?: Message[]; conversation_id?: string } = conversationId
+        ? { message: userMessage.text, conversation_id: conversationId }
+        : { message: userMessage.text, history: messages }; // Seed the new conversation with the greeting
 
       const response = await api.post('/chat/lounge', payload);
+      setConversationId(response.data.conversation_id ?? null);
 
       const aiReply = response.data.reply;
       const lifeLogSaved = response.data.life_log_saved;
@@ -113,6 +115,9 @@ export default function LoungeChat({ initialMessage }: LoungeChatProps) {
       if (error.response && error.response.status === 429 && error.response.data.cooldown) {
         setCooldownMessage(error.response.data.error);
         setMessages(prev => [...prev, { sender: 'ai', text: error.response.data.error }]);
+      } else if (error.response?.data?.conversation_expired) {
+        setConversationId(null);
+        setMessages(prev => [...prev, { sender: 'ai', text: error.response.data.error }]);
       } else {
         setMessages(prev => [...prev, { sender: 'ai', text: "すみません、AIが応答できませんでした。" }]);
       }
@@ -0,0 +1,45 @@
+import api from '@/lib/api';
+import { ActivityLog } from '@/types';
+
+// Deltas pushed by GET /api/events (Server-Sent Events). They carry ids only;
+// fetch the log itself with fetchActivityLog
+export type ActivityEvent =
+  | { type: 'created'; log_id: number; log_type: ActivityLog['log_type'] }
+  | { type: 'deleted'; log_id: number }
+  | { type: 'scored'; log_id: number; score: number | null }
+  | { type: 'resync' }; // Events were dropped; re-fetch from scratch
+
+// null if the log was deleted in the meantime
+export const fetchActivityLog = async (logId: number): Promise<ActivityLog | null> => {
+  try {
+    const response = await api.get(`/history/${logId}`);
+    return response.data;
+  } catch (err: any) {
+    if (err.response?.status === 404) return null;
+    throw err;
+  }
+};
+
+type Listener = (event: ActivityEvent) => void;
+
+// One EventSource per tab, shared by every subscribed component
+const listeners = new Set<Listener>();
+let source: EventSource | null = null;
+
+export const subscribeToActivityEvents = (listener: Listener): (() => void) => {
+  listeners.add(listener);
+  if (!source) {
+    source = new EventSource(`${api.defaults.baseURL}/events`, { withCredentials: true });
+    source.onmessage = (message) => {
+      const event: ActivityEvent = JSON.parse(message.data);
+      listeners.forEach((l) => l(event));
+    };
+  }
+  return () => {
+    listeners.delete(listener);
+    if (listeners.size === 0 && source) {
+      source.close();
+      source = null;
+    }
+  };
+};